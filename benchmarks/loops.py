@@ -0,0 +1,198 @@
+"""
+Compares the event loops the server can run on (see main.py --loop) with real TCP clients.
+For every loop, a server is started in its own process, a swarm of clients connects to it over localhost,
+registers and joins channels, and then random clients talk. We time how long it takes until every
+line of the fan-out has arrived.
+
+The clients all run in this process, on asyncio, so on a small machine they compete with the server for
+CPU. Compare loops with each other, not with swarm.py's in-process numbers.
+
+Run it from the repository root:
+
+    python -m benchmarks.loops --loops twisted asyncio uvloop --clients 200 --messages 2000
+"""
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import random
+import subprocess
+import sys
+import time
+
+LOOPS = ('twisted', 'asyncio', 'uvloop')
+
+
+def start(loop, port):
+    """
+    :type loop: str
+    :type port: int
+    :rtype: subprocess.Popen
+    """
+    return subprocess.Popen([sys.executable, 'main.py', '--loop', loop, '--port', str(port), '--log-level', 'warn',
+                             '--flood-rate', '0'],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+async def connect(port, timeout=10.0):
+    """
+    Connects to port, waiting for the server to come up if it has to.
+
+    :type port: int
+    :type timeout: float
+    :rtype: (asyncio.StreamReader, asyncio.StreamWriter)
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return await asyncio.open_connection('127.0.0.1', port)
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.05)
+
+
+class Counter:
+    """
+    Counts the lines every client gets, and wakes the benchmark up when there have been enough of them.
+    """
+
+    def __init__(self):
+        self.lines = 0
+        self.target = None
+        self.done = asyncio.Event()
+
+    def add(self, count):
+        self.lines += count
+        if self.target is not None and self.lines >= self.target:
+            self.done.set()
+
+
+async def read(reader, counter):
+    """
+    :type reader: asyncio.StreamReader
+    :type counter: Counter
+    """
+    while True:
+        data = await reader.read(65536)
+        if not data:
+            return
+        counter.add(data.count(b'\n'))
+
+
+async def drive(port, clients, channels, messages, seed):
+    """
+    :type port: int
+    :type clients: int
+    :type channels: int
+    :type messages: int
+    :type seed: int
+    :rtype: dict
+    """
+    random.seed(seed)
+    counter = Counter()
+    results = {}
+
+    started = time.perf_counter()
+    swarm = []
+    for number in range(clients):
+        reader, writer = await connect(port)
+        writer.write('NICK qt{number}\r\nUSER qt{number} 0 * :Loop client {number}\r\nJOIN #loop{channel}\r\n'
+                     .format(number=number, channel=number % channels).encode())
+        swarm.append(writer)
+        asyncio.ensure_future(read(reader, counter))
+
+    # Every client gets at least its handshake, its JOIN and NAMES before we start counting
+    while counter.lines < clients * 14:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.2)
+    results['register_seconds'] = time.perf_counter() - started
+
+    members = [len(range(channel, clients, channels)) for channel in range(channels)]
+    senders = [random.randrange(clients) for _ in range(messages)]
+    expected = sum(members[sender % channels] - 1 for sender in senders)
+
+    counter.lines = 0
+    counter.target = expected
+    started = time.perf_counter()
+    for number, sender in enumerate(senders):
+        swarm[sender].write('PRIVMSG #loop{channel} :the quick brown fox jumps over the lazy dog\r\n'
+                            .format(channel=sender % channels).encode())
+        if number % 100 == 99:
+            await swarm[sender].drain()
+
+    try:
+        await asyncio.wait_for(counter.done.wait(), timeout=120)
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - started
+
+    results['expected'] = expected
+    results['delivered'] = counter.lines
+    results['privmsg_seconds'] = elapsed
+    results['lines_per_second'] = counter.lines / elapsed if elapsed else 0.0
+
+    for writer in swarm:
+        writer.close()
+    return results
+
+
+def run(loops=LOOPS, clients=200, channels=4, messages=2000, port=16900, seed=1):
+    """
+    Benchmarks every loop in turn. Loops that can't be started (uvloop isn't installed, say) are left out.
+
+    :type loops: (str, ...)
+    :type clients: int
+    :type channels: int
+    :type messages: int
+    :type port: int
+    :type seed: int
+    :rtype: dict
+    """
+    results = {}
+    for offset, loop in enumerate(loops):
+        if loop == 'uvloop' and importlib.util.find_spec('uvloop') is None:
+            results[loop] = {'error': ['uvloop is not installed']}
+            continue
+
+        server = start(loop, port + offset)
+        try:
+            results[loop] = asyncio.run(drive(port + offset, clients, channels, messages, seed))
+        except OSError:
+            results[loop] = {'error': server.stderr.read().decode().strip().splitlines()[-1:]}
+        finally:
+            server.kill()
+            server.wait()
+    return results
+
+
+def report(results, clients, channels, messages):
+    """
+    :type results: dict
+    :rtype: str
+    """
+    lines = ['{clients} clients in {channels} channels, {messages} messages'.format(
+        clients=clients, channels=channels, messages=messages)]
+    for loop, result in results.items():
+        if 'error' in result:
+            lines.append('  {loop:<8} could not run: {error}'.format(loop=loop, error=' '.join(result['error'])))
+            continue
+        lines.append('  {loop:<8} register {register_seconds:7.3f} s, privmsg {privmsg_seconds:7.3f} s, '
+                     '{delivered}/{expected} lines, {lines_per_second:10.0f} lines/s'.format(loop=loop, **result))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the event loops the server can run on.')
+    parser.add_argument('--loops', nargs='+', choices=LOOPS, default=list(LOOPS))
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--channels', type=int, default=4)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--port', type=int, default=16900, help='the first port to use, every loop gets the next one')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    results = run(args.loops, args.clients, args.channels, args.messages, args.port, args.seed)
+    print(json.dumps(results, indent=2) if args.json else report(results, args.clients, args.channels, args.messages))
@@ -0,0 +1,232 @@
+"""
+Micro-benchmarks for the code every message goes through: line framing, parsing, dispatch, Protocol's formatters,
+Client.identity and Channel.say's fan-out at a few channel sizes.
+
+Every benchmark reports the best time per operation out of a few runs, in nanoseconds.
+Save the results of one commit and compare another against them:
+
+    python -m benchmarks.micro --output before.json
+    git checkout something-else
+    python -m benchmarks.micro --compare before.json
+
+Pass --filter to run only the benchmarks whose name contains a string.
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import timeit
+
+import main
+from domain.channel import Channel
+from domain.client import Client
+from domain.message import Message
+from domain.protocol import Protocol
+from system.floodcontrol import FloodControl
+from system.ircfactory import IRCFactory
+from system.messagehandler import MessageHandler
+from util import logger
+from util.linebuffer import LineBuffer
+from util.wildcard import matchmask
+
+CHANNEL_SIZES = (10, 100, 1000, 10000)
+
+LINES = {'ping': 'PING :irc.example.net',
+         'privmsg': 'PRIVMSG #aardvark :Aardvarks are awesome, and so is everyone in here',
+         'prefixed': ':qtfriend!~qtfriend@qtmost4ever PRIVMSG #aardvark :Aardvarks are awesome',
+         'tagged': '@time=2016-01-01T00:00:00.000Z;msgid=abc\\sdef :qtfriend PRIVMSG #aardvark :hi',
+         'user': 'USER qtfriend 0 * :Some qt friend'}
+
+
+def makeclient(nick):
+    """
+    A registered client whose send and write do nothing, so only our own code gets timed.
+
+    :type nick: str
+    :rtype: Client
+    """
+    client = Client(sendfunc=lambda data: None, writefunc=lambda data: None, nick=nick, name=nick)
+    client.user = nick
+    client.registered = True
+    return client
+
+
+def makechannel(size):
+    """
+    :type size: int
+    :rtype: (Channel, Client)
+    """
+    owner = makeclient('qt0')
+    channel = Channel(name='#aardvark', owner=owner)
+    channel.add(owner)
+    for number in range(1, size):
+        channel.add(makeclient('qt{number}'.format(number=number)))
+    return channel, owner
+
+
+def benchmarks():
+    """
+    Every benchmark, as (name, function to time) pairs.
+
+    :rtype: [(str, function), ...]
+    """
+    client = makeclient('qtfriend')
+    channel, _ = makechannel(10)
+    message = 'Aardvarks are awesome, and so is everyone in here'
+
+    factory = IRCFactory(reactor=object())
+    factory.channels[channel.name] = channel
+    factory.setnick(client, client.nick)
+    for number, member in enumerate(channel.clients):
+        member.uid = factory.sid + str(number).zfill(6)
+        factory.setnick(member, member.nick)
+        factory.register(member)
+
+    cases = []
+
+    framing = LineBuffer()
+    chunk = ''.join(line + '\r\n' for _, line in sorted(LINES.items())).encode()
+    cases.append(('frame {count} lines'.format(count=len(LINES)), lambda: framing.feed(chunk)))
+    cases.append(('frame split line', lambda: (framing.feed(chunk[:40]), framing.feed(chunk[40:]))))
+
+    for name, line in sorted(LINES.items()):
+        cases.append(('parse ' + name, lambda line=line: Message.parse(line)))
+
+    for name in ('PRIVMSG', 'PING', 'MODE', 'NOSUCHCOMMAND'):
+        cases.append(('getfunc ' + name, lambda name=name: MessageHandler.getfunc(name)))
+
+    ping = Message.parse(LINES['ping'])
+    privmsg = Message.parse(LINES['privmsg'])
+    cases.append(('handleline PING', lambda: MessageHandler.handleline(ping, client, factory)))
+    cases.append(('handleline PRIVMSG 10 members', lambda: MessageHandler.handleline(privmsg, client, factory)))
+    cases.append(('flood cost PRIVMSG 10 members', lambda: FloodControl.cost(privmsg, factory)))
+
+    for name, line in (('WHO 10 members', 'WHO #aardvark'), ('WHO nick', 'WHO qt3'), ('WHOIS', 'WHOIS qt3'),
+                       ('WHO *a*a*a*a*a*a*b', 'WHO *a*a*a*a*a*a*b')):
+        cases.append(('handleline ' + name,
+                      lambda message=Message.parse(line): MessageHandler.handleline(message, client, factory)))
+
+    cases += [('protocol privmsg', lambda: Protocol.privmsg(client, channel.name, message)),
+              ('protocol notice', lambda: Protocol.notice(client, channel.name, message)),
+              ('protocol join', lambda: Protocol.join(client, channel)),
+              ('protocol part', lambda: Protocol.part(client, channel, 'Leaving')),
+              ('protocol quit', lambda: Protocol.quit(client, 'Quit')),
+              ('protocol topic', lambda: Protocol.topic(client, channel)),
+              ('protocol names', lambda: Protocol.names(client, channel, 'qt0 qt1 qt2')),
+              ('protocol endofnames', lambda: Protocol.endofnames(client, channel.name)),
+              ('protocol nosuchnick', lambda: Protocol.nosuchnick(client, 'nobody')),
+              ('protocol needmoreparams', lambda: Protocol.needmoreparams(client, 'JOIN')),
+              ('protocol handshake', lambda: Protocol.handshake(client)),
+              ('protocol nick announce', lambda: Protocol.Nick.announce(client, 'qtenemy')),
+              ('protocol encode', lambda: Protocol.encode(':qtfriend PRIVMSG #aardvark :' + message))]
+
+    cases.append(('client identity', lambda: client.identity))
+    cases.append(('mask match', lambda: matchmask('#qt*fr?end*', '#QtFriends')))
+
+    def renamed():
+        client.nick = 'qtfriend'
+        return client.identity
+
+    cases.append(('client identity after nick change', renamed))
+
+    for size in CHANNEL_SIZES:
+        big, speaker = makechannel(size)
+        cases.append(('channel say {size} members'.format(size=size),
+                      lambda big=big, speaker=speaker: big.say(speaker, message)))
+        cases.append(('channel names {size} members'.format(size=size),
+                      lambda big=big, speaker=speaker: big.names(speaker)))
+
+        def churn(big=big, speaker=speaker, newcomer=makeclient('qtnew')):
+            big.add(newcomer)
+            big.names(speaker)
+            big.discard(newcomer)
+
+        cases.append(('channel join, names, part {size} members'.format(size=size), churn))
+
+    return cases
+
+
+def measure(func, repeat=5, budget=0.2):
+    """
+    Times func and returns the best nanoseconds per call. Each run takes roughly budget seconds.
+
+    :type func: function
+    :type repeat: int
+    :type budget: float
+    :rtype: float
+    """
+    timer = timeit.Timer(func)
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * budget / max(elapsed, 1e-9)))
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e9
+
+
+def commit():
+    """
+    The commit we're benchmarking, if we're in a git checkout.
+
+    :rtype: str | None
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(pattern=''):
+    """
+    Runs the benchmarks whose name contains pattern, and returns the results.
+
+    :type pattern: str
+    :rtype: dict
+    """
+    logger.level = logger.WARN
+    main.addhooks()
+
+    return {'commit': commit(),
+            'python': platform.python_version(),
+            'results': {name: measure(func) for name, func in benchmarks() if pattern in name}}
+
+
+def report(results, baseline=None):
+    """
+    :type results: dict
+    :type baseline: dict
+    :rtype: str
+    """
+    header = 'commit {commit}, python {python}'.format(**results)
+    if baseline is not None:
+        header += ', compared to commit {commit}'.format(**baseline)
+
+    lines = [header]
+    for name, ns in results['results'].items():
+        line = '  {name:<40}{ns:>12.0f} ns'.format(name=name, ns=ns)
+        old = baseline['results'].get(name) if baseline is not None else None
+        if old:
+            line += '{old:>12.0f} ns {change:>+8.1%}'.format(old=old, change=ns / old - 1)
+        lines.append(line)
+
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the hot paths.')
+    parser.add_argument('--filter', default='', help='only run benchmarks whose name contains this')
+    parser.add_argument('--output', help='save the results as JSON here')
+    parser.add_argument('--compare', help='compare against results saved with --output')
+    args = parser.parse_args()
+
+    results = run(args.filter)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    print(report(results, baseline))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
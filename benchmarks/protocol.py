@@ -0,0 +1,69 @@
+"""
+Times Protocol's formatters against the str.format templates they replaced.
+Run it from the repository root:
+
+    python -m benchmarks.protocol
+"""
+
+import timeit
+
+from domain.channel import Channel
+from domain.client import Client
+from domain.constants import Response
+from domain.protocol import Protocol
+
+HANDSHAKE = [line.replace('{server}', 'localhost') for line in Protocol.HANDSHAKE]
+
+
+def handshake_format(client):
+    return [line.format(nick=client.nick, **Response.todict()) for line in HANDSHAKE]
+
+
+def privmsg_format(client, target, message):
+    return ":{identity} PRIVMSG {target} :{message}".format(identity=client.identity, target=target, message=message)
+
+
+def join_format(client, channel):
+    return ":{identity} JOIN {channel}".format(identity=client.identity, channel=channel.name)
+
+
+def part_format(client, channel, reason):
+    return ":{identity} PART {channel} :{reason}".format(identity=client.identity, channel=channel.name, reason=reason)
+
+
+def quit_format(client, reason):
+    return ":{identity} QUIT :{reason}".format(identity=client.identity, reason=reason)
+
+
+def announce_format(client, newnick):
+    return ":{identity} NICK {newnick}".format(identity=client.identity, newnick=newnick)
+
+
+def main(number=200000):
+    client = Client(sendfunc=None, writefunc=None, nick='qtfriend', name='qtfriend')
+    channel = Channel(name='#aardvark', owner=client)
+    message = 'Aardvarks are awesome, and so is everyone in here'
+
+    cases = [('privmsg', lambda: privmsg_format(client, channel.name, message),
+              lambda: Protocol.privmsg(client, channel.name, message)),
+             ('join', lambda: join_format(client, channel),
+              lambda: Protocol.join(client, channel)),
+             ('part', lambda: part_format(client, channel, 'Leaving'),
+              lambda: Protocol.part(client, channel, 'Leaving')),
+             ('quit', lambda: quit_format(client, 'Quit'),
+              lambda: Protocol.quit(client, 'Quit')),
+             ('nick announce', lambda: announce_format(client, 'qtenemy'),
+              lambda: Protocol.Nick.announce(client, 'qtenemy')),
+             ('handshake', lambda: handshake_format(client),
+              lambda: Protocol.handshake(client))]
+
+    print('{:<16}{:>14}{:>14}{:>10}'.format('formatter', 'format ns/op', 'Protocol', 'speedup'))
+    for name, before, after in cases:
+        assert before() == after(), name
+        old = min(timeit.repeat(before, number=number, repeat=3)) / number * 1e9
+        new = min(timeit.repeat(after, number=number, repeat=3)) / number * 1e9
+        print('{:<16}{:>14.0f}{:>14.0f}{:>9.2f}x'.format(name, old, new, old / new))
+
+
+if __name__ == '__main__':
+    main()
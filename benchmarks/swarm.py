@@ -0,0 +1,234 @@
+"""
+Drives a swarm of simulated clients through a real IRCFactory and real ClientConnections, in-process.
+Nothing touches the network: every connection gets a transport that just counts what it's given
+and notes when, and the reactor is a clock we advance by hand, so a flush happens exactly when we say.
+
+Twisted's own task.Clock re-sorts all its calls on every callLater, which would make the benchmark
+measure the clock instead of the server, so HeapClock keeps them in a heap like the real reactor does.
+
+Every client registers (NICK, USER), joins one of the channels, and then random clients talk.
+For every PRIVMSG we measure how long it took from the line coming in until it was handed to each
+recipient's transport, which is the fan-out latency. Then everyone PARTs and QUITs.
+
+Run it from the repository root:
+
+    python -m benchmarks.swarm --clients 2000 --channels 10 --messages 2000
+"""
+
+import argparse
+import heapq
+import itertools
+import json
+import random
+import time
+import tracemalloc
+
+from twisted.internet.protocol import connectionDone
+from twisted.internet.testing import StringTransport
+
+import main
+from system.clientconnection import ClientConnection
+from system.ircfactory import IRCFactory
+from util import logger
+
+
+class HeapCall:
+    """
+    What HeapClock.callLater returns. It can be cancelled, and that's about it.
+    """
+
+    __slots__ = ('time', 'func', 'args', 'kw', 'called', 'cancelled')
+
+    def __init__(self, time, func, args, kw):
+        self.time = time
+        self.func = func
+        self.args = args
+        self.kw = kw
+        self.called = False
+        self.cancelled = False
+
+    def active(self):
+        return not (self.called or self.cancelled)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def getTime(self):
+        return self.time
+
+
+class HeapClock:
+    """
+    Enough of IReactorTime for the server, with the calls kept in a heap. Time only moves when you advance it.
+    """
+
+    def __init__(self):
+        self._now = 0.0
+        self._calls = []
+        self._sequence = itertools.count()
+
+    def seconds(self):
+        return self._now
+
+    def callLater(self, delay, func, *args, **kw):
+        call = HeapCall(self._now + delay, func, args, kw)
+        heapq.heappush(self._calls, (call.time, next(self._sequence), call))
+        return call
+
+    def advance(self, amount):
+        self._now += amount
+        while self._calls and self._calls[0][0] <= self._now:
+            _, _, call = heapq.heappop(self._calls)
+            if call.active():
+                call.called = True
+                call.func(*call.args, **call.kw)
+
+
+class TimedTransport(StringTransport):
+    """
+    A transport that throws away what's written to it, but remembers how much it was and when it arrived.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.lines = 0
+        self.bytes = 0
+        self.arrivals = []
+
+    def write(self, data):
+        self.arrivals.append(time.perf_counter())
+        self.lines += data.count(b'\n')
+        self.bytes += len(data)
+
+    def writeSequence(self, seq):
+        self.write(b''.join(seq))
+
+
+def percentile(values, fraction):
+    """
+    :type values: [float, ...]
+    :type fraction: float
+    :rtype: float
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run(clients=2000, channels=10, messages=2000, seed=1):
+    """
+    Runs the whole thing and returns the numbers.
+
+    :type clients: int
+    :type channels: int
+    :type messages: int
+    :type seed: int
+    :rtype: dict
+    """
+    logger.level = logger.WARN
+    main.addhooks()
+    random.seed(seed)
+
+    clock = HeapClock()
+    factory = IRCFactory(reactor=clock, floodrate=0)  # the swarm talks far faster than flood control allows
+    factory.protocol = ClientConnection
+
+    results = {'clients': clients, 'channels': channels, 'messages': messages}
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+
+    swarm = []
+    for number in range(clients):
+        connection = factory.buildProtocol(None)
+        transport = TimedTransport()
+        connection.makeConnection(transport)
+        connection.dataReceived('NICK qt{number}\r\nUSER qt{number} 0 * :Swarm client {number}\r\n'
+                                .format(number=number).encode())
+        swarm.append((connection, transport))
+    clock.advance(0)
+
+    results['register_seconds'] = time.perf_counter() - started
+    results['memory_per_connection'] = (tracemalloc.get_traced_memory()[0] - before) / clients
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    for number, (connection, transport) in enumerate(swarm):
+        connection.dataReceived('JOIN #swarm{channel}\r\n'.format(channel=number % channels).encode())
+        clock.advance(0)
+    results['join_seconds'] = time.perf_counter() - started
+
+    for connection, transport in swarm:
+        transport.arrivals = []
+        transport.lines = 0
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(messages):
+        number = random.randrange(clients)
+        connection, _ = swarm[number]
+        line = 'PRIVMSG #swarm{channel} :the quick brown fox jumps over the lazy dog\r\n'.format(
+            channel=number % channels).encode()
+
+        sent = time.perf_counter()
+        connection.dataReceived(line)
+        clock.advance(0)
+
+        for _, transport in swarm[number % channels::channels]:
+            if transport.arrivals:
+                latencies.extend(arrival - sent for arrival in transport.arrivals)
+                transport.arrivals = []
+    elapsed = time.perf_counter() - started
+
+    delivered = sum(transport.lines for _, transport in swarm)
+    results['privmsg_seconds'] = elapsed
+    results['delivered'] = delivered
+    results['messages_per_second'] = delivered / elapsed if elapsed else 0.0
+    results['fanout_p50_us'] = percentile(latencies, 0.50) * 1e6
+    results['fanout_p99_us'] = percentile(latencies, 0.99) * 1e6
+
+    started = time.perf_counter()
+    for number, (connection, transport) in enumerate(swarm):
+        connection.dataReceived('PART #swarm{channel} :bye\r\n'.format(channel=number % channels).encode())
+        clock.advance(0)
+    results['part_seconds'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for connection, transport in swarm:
+        connection.dataReceived(b'QUIT :bye\r\n')
+        connection.connectionLost(connectionDone)
+    clock.advance(0)
+    results['quit_seconds'] = time.perf_counter() - started
+
+    return results
+
+
+def report(results):
+    """
+    :type results: dict
+    :rtype: str
+    """
+    return '\n'.join(['{clients} clients in {channels} channels, {messages} messages'.format(**results),
+                      '  register   {register_seconds:10.3f} s'.format(**results),
+                      '  memory     {memory_per_connection:10.0f} bytes/connection'.format(**results),
+                      '  join       {join_seconds:10.3f} s'.format(**results),
+                      '  privmsg    {privmsg_seconds:10.3f} s, {delivered} lines delivered'.format(**results),
+                      '  throughput {messages_per_second:10.0f} lines/s'.format(**results),
+                      '  fan-out    {fanout_p50_us:10.1f} us p50, {fanout_p99_us:.1f} us p99'.format(**results),
+                      '  part       {part_seconds:10.3f} s'.format(**results),
+                      '  quit       {quit_seconds:10.3f} s'.format(**results)])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a swarm of simulated clients through the server.')
+    parser.add_argument('--clients', type=int, default=2000)
+    parser.add_argument('--channels', type=int, default=10)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    results = run(args.clients, args.channels, args.messages, args.seed)
+    print(json.dumps(results, indent=2) if args.json else report(results))
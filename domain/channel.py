@@ -1,14 +1,20 @@
-from builtins import property
+from builtins import len, property
 
+from domain.namelist import NameList
 from domain.protocol import Protocol
+from util.memberset import MemberSet
 
 
 class Channel:
     """
     This is a channel. Each channel has a list of clients and a method that can send the same thing to every client in a loop.
-    It actually has two, and they're very similar to each other. The difference is that send() sends to everyone in the channel, while say() sends to everyone except the client who caused the message to be sent in the first place.
+    It actually has a few, and they're very similar to each other. Lines are encoded once, and the same bytes go to everyone. The difference is that send() sends to everyone in the channel, while say() sends to everyone except the client who caused the message to be sent in the first place.
+
+    The channel also keeps its NAMES reply ready to send (see domain.namelist), so clients come and go through add() and discard(), and renamed() is called when one changes their nick.
     """
 
+    __slots__ = ('_name', '_owner', '_topic', '_clients', '_names')
+
     def __init__(self, name, owner, topic="no topic"):
         """
         :type name: str
@@ -18,7 +24,8 @@ class Channel:
         self._name = name
         self._owner = owner
         self._topic = topic
-        self._clients = []  # list of clients
+        self._clients = MemberSet()  # clients, with their prefix as member data
+        self._names = NameList(Protocol.namesroom(name, Protocol.NICKLEN))
 
     @property
     def name(self):
@@ -52,13 +59,61 @@ class Channel:
     @property
     def clients(self):
         """
-        A list of clients currently in the channel.
+        The clients currently in the channel, in the order they joined.
         Each client needs to have this channel in their channel list as well!
+        Use add() and discard() to change who's in here, not this.
 
-        :rtype: [Client, ...]
+        :rtype: MemberSet
         """
         return self._clients
 
+    def add(self, client, prefix=''):
+        """
+        Puts client in the channel, unless they're in it already. Returns True if they weren't.
+
+        :type client: Client
+        :type prefix: str
+        :rtype: bool
+        """
+        if not self._clients.add(client, prefix):
+            return False
+        self._names.add(client, prefix + client.nick)
+        return True
+
+    def discard(self, client):
+        """
+        Takes client out of the channel, if they're in it. Returns True if they were.
+
+        :type client: Client
+        :rtype: bool
+        """
+        if not self._clients.discard(client):
+            return False
+        self._names.discard(client)
+        return True
+
+    def renamed(self, client):
+        """
+        Tells the channel that client has a new nick.
+
+        :type client: Client
+        :rtype: None
+        """
+        self._names.update(client, self._clients.get(client, '') + client.nick)
+
+    def names(self, client):
+        """
+        Everyone in the channel, with their prefix, in as few chunks as fit in client's RPL_NAMREPLY lines.
+
+        :example: ["@qtfriend qtenemy", "aardvark"]
+        :type client: Client
+        :rtype: [str, ...]
+        """
+        nicklen = NameList.measure(client.nick)  # in bytes, like the room in a line
+        if nicklen <= Protocol.NICKLEN:
+            return self._names.chunks()
+        return self._names.chunks(Protocol.namesroom(self._name, nicklen))
+
     def send(self, data):
         """
         Sends data to everyone in the channel. It can be anything, like a join message.
@@ -66,8 +121,17 @@ class Channel:
         :type data: str
         :rtype: None
         """
+        self.write(Protocol.encode(data))
+
+    def write(self, data):
+        """
+        Writes already encoded data to everyone in the channel. Everyone gets the very same bytes object.
+
+        :type data: bytes
+        :rtype: None
+        """
         for cl in self._clients:
-            cl.send(data)
+            cl.write(data)
 
     def say(self, client, message):
         """
@@ -77,7 +141,16 @@ class Channel:
         :type message: str
         :rtype: None
         """
-        message = Protocol.privmsg(client, self, message)
+        self.relay(client, Protocol.encode(Protocol.privmsg(client, self._name, message)))
+
+    def relay(self, client, data):
+        """
+        Writes already encoded data to everyone in the channel except client, usually because they sent it.
+
+        :type client: Client
+        :type data: bytes
+        :rtype: None
+        """
         for cl in self._clients:
             if cl is not client:
-                cl.send(message)
\ No newline at end of file
+                cl.write(data)
@@ -1,18 +1,42 @@
 from builtins import property
 
+from util.memberset import MemberSet
+
 
 class Client:
     """
     This is how we know who a user is. It's pretty much just a data store, but it also
-    has a function to call its personal ClientConnection's send method.
+    has functions to call its personal ClientConnection's send and write methods.
+
+    There's one of these for every connection, so it's slotted to keep it small.
+    The identity string is built when it's first asked for, and rebuilt only after nick, user or host change.
+
+    Users on other servers (or other worker processes) get a Client too, so channels and nicks work the same
+    for everyone. Theirs have a link, the connection they're behind, and their send and write do nothing:
+    whatever they should hear is passed along over the link once, not once per remote user.
     """
 
-    def __init__(self, sendfunc, nick="anonymous", name="anonymous", host="anonymous"):
+    __slots__ = ('_nick', '_name', '_host', '_mode', '_identity', '_channels', '_sendfunc', '_writefunc',
+                 '_streamfunc', '_quitfunc', '_user', 'uid', 'ts', 'link', 'registered')
+
+    def __init__(self, sendfunc, writefunc, nick="anonymous", name="anonymous", host="anonymous", streamfunc=None,
+                 quitfunc=None):
         self._nick = nick
         self._name = name
         self._host = "qtmost4ever"
-        self._channels = []
+        self._mode = ""
+        self._identity = None
+        self._channels = MemberSet()
         self._sendfunc = sendfunc
+        self._writefunc = writefunc
+        self._streamfunc = streamfunc
+        self._quitfunc = quitfunc
+
+        self._user = None  # the username from USER, None until it's been sent
+        self.uid = None  # unique across the whole network, see IRCFactory.nextuid()
+        self.ts = 0  # when the nick was taken, whoever's older keeps it in a nick collision
+        self.link = None  # the Link a remote user is behind, None for our own users
+        self.registered = False
 
     @property
     def nick(self):
@@ -32,6 +56,15 @@ class Client:
         """
         return self._name
 
+    @property
+    def user(self):
+        """
+        This client's username, from USER. None until they've sent it.
+
+        :rtype: str | None
+        """
+        return self._user
+
     @property
     def host(self):
         """
@@ -41,24 +74,47 @@ class Client:
         """
         return self._host
 
+    @property
+    def mode(self):
+        """
+        This client's user modes, without the +.
+
+        :example: "iw"
+        :rtype: str
+        """
+        return self._mode
+
     @nick.setter
     def nick(self, value):
         self._nick = value
+        self._identity = None
 
     @name.setter
     def name(self, value):
         self._name = value
+        self._identity = None
+
+    @user.setter
+    def user(self, value):
+        self._user = value
+        self._identity = None
 
     @host.setter
     def host(self, value):
         self._host = value
+        self._identity = None
+
+    @mode.setter
+    def mode(self, value):
+        self._mode = value
 
     @property
     def channels(self):
         """
-        The channels this client is in. Each channel needs to have this client in their client list as well!
+        The channels this client is in, in the order they were joined.
+        Each channel needs to have this client in their client list as well!
 
-        :rtype: [Channel, ...]
+        :rtype: MemberSet
         """
         return self._channels
 
@@ -69,7 +125,10 @@ class Client:
 
         :rtype: str
         """
-        return "{nick}!~{name}@{host}".format(nick=self._nick, name=self._name, host=self._host)
+        if self._identity is None:
+            user = self._user if self._user is not None else self._name
+            self._identity = self._nick + '!~' + user + '@' + self._host
+        return self._identity
 
     @property
     def send(self):
@@ -78,3 +137,29 @@ class Client:
         :rtype: function
         """
         return self._sendfunc
+
+    @property
+    def write(self):
+        """
+        This points to ClientConnection.write(), which takes already encoded bytes.
+        :rtype: function
+        """
+        return self._writefunc
+
+    @property
+    def stream(self):
+        """
+        This points to ClientConnection.stream(), which takes a producer for a long reply.
+        Remote users don't have one.
+        :rtype: function | None
+        """
+        return self._streamfunc
+
+    @property
+    def quit(self):
+        """
+        This points to ClientConnection.quit(), which says goodbye and hangs up, for when the client QUITs.
+        Remote users don't have one.
+        :rtype: function | None
+        """
+        return self._quitfunc
@@ -78,6 +78,7 @@ class Response(Dictable):
     RPL_ENDOFSTATS = "219"
     RPL_STATSUPTIME = "242"
     RPL_STATSOLINE = "243"
+    RPL_STATSDEBUG = "249"
     RPL_UMODEIS = "221"
     RPL_SERVLIST = "234"
     RPL_SERVLISTEND = "235"
@@ -108,6 +109,7 @@ class Error(Dictable):
     ERR_NOTOPLEVEL = "413"
     ERR_WILDTOPLEVEL = "414"
     ERR_BADMASK = "415"
+    ERR_INPUTTOOLONG = "417"
     ERR_UNKNOWNCOMMAND = "421"
     ERR_NOMOTD = "422"
     ERR_NOADMININFO = "423"
@@ -0,0 +1,176 @@
+"""
+Based on RFC 2812, with IRCv3 message tags on top
+https://tools.ietf.org/html/rfc2812#section-2.3.1
+https://ircv3.net/specs/extensions/message-tags
+"""
+
+from builtins import staticmethod
+
+
+class Message:
+    """
+    A parsed line from a client. This is what hooks get instead of the raw line.
+    It's the other half of Protocol: Protocol writes IRC, Message reads it.
+
+    The trailing parameter, if there is one, is always the last item in params, whether it was sent
+    with a colon or not. trailing is only set when it came with a colon, so you can tell the difference.
+    """
+
+    __slots__ = ('tags', 'prefix', 'command', 'params', 'trailing')
+
+    TAG_ESCAPES = {':': ';', 's': ' ', '\\': '\\', 'r': '\r', 'n': '\n'}
+
+    def __init__(self, command, params=None, prefix=None, tags=None, trailing=None):
+        """
+        :type command: str
+        :type params: [str, ...]
+        :type prefix: str
+        :type tags: dict
+        :type trailing: str
+        """
+        self.tags = tags
+        self.prefix = prefix
+        self.command = command
+        self.params = params if params is not None else []
+        self.trailing = trailing
+
+    def __repr__(self):
+        return 'Message({command!r}, {params!r}, prefix={prefix!r}, tags={tags!r})'.format(command=self.command,
+                                                                                          params=self.params,
+                                                                                          prefix=self.prefix,
+                                                                                          tags=self.tags)
+
+    def __str__(self):
+        """
+        Puts the line back together. It won't be byte for byte what was sent (extra spaces are gone,
+        and the trailing colon is only there when it's needed), but it means the same thing.
+        """
+        parts = []
+        if self.tags:
+            parts.append('@' + ';'.join(key + '=' + Message.escape(value) if value else key
+                                        for key, value in self.tags.items()))
+        if self.prefix is not None:
+            parts.append(':' + self.prefix)
+        parts.append(self.command)
+
+        params = self.params
+        if params:
+            last = params[-1]
+            if self.trailing is not None or not last or ' ' in last or last.startswith(':'):
+                parts.extend(params[:-1])
+                parts.append(':' + last)
+            else:
+                parts.extend(params)
+
+        return ' '.join(parts)
+
+    @staticmethod
+    def parse(line):
+        """
+        Parses a line in one pass. Returns None if there's no command in it.
+        Commands are uppercased, everything else is left alone.
+
+        :example: parse('@id=1 :nick!~name@host PRIVMSG #aardvark :hi there')
+        :type line: str
+        :rtype: Message | None
+        """
+        length = len(line)
+        pos = 0
+        tags = None
+        prefix = None
+
+        if line.startswith('@'):
+            end = line.find(' ')
+            if end == -1:
+                return None
+            tags = Message.parsetags(line[1:end])
+            pos = end
+
+        while pos < length and line[pos] == ' ':
+            pos += 1
+
+        if line.startswith(':', pos):
+            end = line.find(' ', pos)
+            if end == -1:
+                return None
+            prefix = line[pos + 1:end]
+            pos = end
+
+            while pos < length and line[pos] == ' ':
+                pos += 1
+
+        end = line.find(' ', pos)
+        if end == -1:
+            end = length
+        command = line[pos:end].upper()
+        if not command:
+            return None
+        pos = end
+
+        params = []
+        trailing = None
+        while pos < length:
+            if line[pos] == ' ':
+                pos += 1
+                continue
+
+            if line[pos] == ':':
+                trailing = line[pos + 1:]
+                params.append(trailing)
+                break
+
+            end = line.find(' ', pos)
+            if end == -1:
+                end = length
+            params.append(line[pos:end])
+            pos = end
+
+        return Message(command, params, prefix, tags, trailing)
+
+    @staticmethod
+    def parsetags(raw):
+        """
+        Turns the tag part of a line (without the @) into a dict. Tags without a value get ''.
+
+        :example: parsetags('id=1;+draft/reply=abc;flag')
+        :type raw: str
+        :rtype: dict
+        """
+        tags = {}
+        for tag in raw.split(';'):
+            if not tag:
+                continue
+            key, _, value = tag.partition('=')
+            if '\\' in value:
+                value = Message.unescape(value)
+            tags[key] = value
+        return tags
+
+    @staticmethod
+    def unescape(value):
+        """
+        Undoes IRCv3 tag value escaping. Unknown escapes lose their backslash, and a lone trailing one is dropped.
+
+        :type value: str
+        :rtype: str
+        """
+        result = []
+        chars = iter(value)
+        for char in chars:
+            if char == '\\':
+                char = next(chars, '')
+                char = Message.TAG_ESCAPES.get(char, char)
+            result.append(char)
+        return ''.join(result)
+
+    @staticmethod
+    def escape(value):
+        """
+        Does IRCv3 tag value escaping, the opposite of unescape.
+
+        :type value: str
+        :rtype: str
+        """
+        for char, escaped in (('\\', '\\\\'), (';', '\\:'), (' ', '\\s'), ('\r', '\\r'), ('\n', '\\n')):
+            value = value.replace(char, escaped)
+        return value
@@ -0,0 +1,186 @@
+"""
+A channel's NAMES reply, kept ready to send.
+
+RPL_NAMREPLY lines have to fit in 512 bytes like everything else, so a big channel's names are sent in chunks,
+each one a space separated list of prefixed nicks that fits in one line. Rather than building those from scratch
+(through every member) whenever someone joins or asks, a NameList keeps the chunks and changes just the one
+that's affected when someone joins, leaves or changes their nick. Newcomers go in the last chunk,
+or a new one when that's full.
+
+When people leave, chunks get emptier, so once there are twice as many chunks as the names need,
+they're all packed again.
+"""
+
+from builtins import dict, len, property
+
+
+class NameChunk:
+    """
+    Up to one line's worth of names. The text is joined when it's first asked for,
+    and again only after the chunk changed.
+    """
+
+    __slots__ = ('names', 'size', '_text')
+
+    def __init__(self):
+        self.names = dict()  # member -> prefixed nick
+        self.size = 0  # bytes the names take up, with the spaces between them
+        self._text = None
+
+    @property
+    def text(self):
+        """
+        :example: "@qtfriend +qtenemy aardvark"
+        :rtype: str
+        """
+        if self._text is None:
+            self._text = ' '.join(self.names.values())
+        return self._text
+
+    def add(self, member, name, size):
+        """
+        :type member: object
+        :type name: str
+        :type size: int
+        """
+        self.names[member] = name
+        self.size += size + (1 if len(self.names) > 1 else 0)
+        self._text = None
+
+    def replace(self, member, name, change):
+        """
+        :type member: object
+        :type name: str
+        :type change: int
+        """
+        self.names[member] = name
+        self.size += change
+        self._text = None
+
+    def remove(self, member, size):
+        """
+        :type member: object
+        :type size: int
+        """
+        del self.names[member]
+        self.size -= size + (1 if self.names else 0)
+        self._text = None
+
+
+class NameList:
+    """
+    The names of everyone in a channel, chunked so every chunk fits in room bytes.
+    """
+
+    __slots__ = ('_room', '_chunks', '_where', '_size')
+
+    def __init__(self, room):
+        """
+        :type room: int
+        """
+        self._room = room
+        self._chunks = []
+        self._where = dict()  # member -> the NameChunk they're in
+        self._size = 0  # bytes all the names take up, without spaces
+
+    def __len__(self):
+        return len(self._where)
+
+    @staticmethod
+    def measure(name):
+        """
+        How many bytes name takes up in a line.
+
+        :type name: str
+        :rtype: int
+        """
+        return len(name) if name.isascii() else len(name.encode('utf-8'))
+
+    def add(self, member, name):
+        """
+        Adds a member, as name (their nick, with their prefix if they have one), at the end.
+
+        :type member: object
+        :type name: str
+        :rtype: None
+        """
+        size = NameList.measure(name)
+        chunk = self._chunks[-1] if self._chunks else None
+        if chunk is None or (chunk.names and chunk.size + 1 + size > self._room):
+            chunk = NameChunk()
+            self._chunks.append(chunk)
+
+        chunk.add(member, name, size)
+        self._where[member] = chunk
+        self._size += size
+
+    def discard(self, member):
+        """
+        Takes a member out, if they're in here.
+
+        :type member: object
+        :rtype: None
+        """
+        chunk = self._where.pop(member, None)
+        if chunk is None:
+            return
+
+        size = NameList.measure(chunk.names[member])
+        chunk.remove(member, size)
+        self._size -= size
+
+        if not chunk.names:
+            self._chunks.remove(chunk)
+        elif len(self._chunks) > 2 * (self._size // self._room + 1):
+            self.pack()
+
+    def update(self, member, name):
+        """
+        Changes the name a member goes by. They stay where they are, unless their chunk is full,
+        then they go at the end.
+
+        :type member: object
+        :type name: str
+        :rtype: None
+        """
+        chunk = self._where.get(member)
+        if chunk is None:
+            return
+
+        old, new = NameList.measure(chunk.names[member]), NameList.measure(name)
+        if chunk.size - old + new <= self._room:
+            chunk.replace(member, name, new - old)
+            self._size += new - old
+        else:
+            self.discard(member)
+            self.add(member, name)
+
+    def pack(self):
+        """
+        Puts all the names in as few chunks as they fit in, keeping their order.
+
+        :rtype: None
+        """
+        names = [(member, name) for chunk in self._chunks for member, name in chunk.names.items()]
+        self._chunks = []
+        self._where = dict()
+        self._size = 0
+        for member, name in names:
+            self.add(member, name)
+
+    def chunks(self, room=None):
+        """
+        The names, as the text of every chunk. With room, they're chunked to fit in that instead,
+        from scratch, for when a line has less room than usual.
+
+        :type room: int
+        :rtype: [str, ...]
+        """
+        if room is None or room >= self._room:
+            return [chunk.text for chunk in self._chunks]
+
+        packed = NameList(room)
+        for chunk in self._chunks:
+            for member, name in chunk.names.items():
+                packed.add(member, name)
+        return packed.chunks()
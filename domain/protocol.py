@@ -1,6 +1,6 @@
 from builtins import *
 
-from domain.constants import Response
+from domain.constants import Response, Error
 from domain.client import Client
 
 
@@ -11,24 +11,118 @@ class Protocol:
 
     Don't write raw IRC anywhere else.
 
+    Everything that's the same every time (the server name, numerics, the MOTD) is put together once, by setserver,
+    when the server gets its name. The methods only glue the bits that change onto it, which is a lot cheaper
+    than str.format.
+
     https://tools.ietf.org/html/rfc2812
     """
 
+    SERVER = 'localhost'  # what we call ourselves, see setserver
+    SERVERINFO = 'A kawaiirc server'  # what RPL_WHOISSERVER says about every server
+    NICKLEN = 30  # the longest nick our users can have, NAMES replies are sized for nicks up to this long
+
+    # Numeric prefixes setserver puts together, like _NOSUCHNICK = ':localhost 401 '
+    _NUMERICS = {
+        '_NOSUCHNICK': Error.ERR_NOSUCHNICK,
+        '_NICKNAMEINUSE': Error.ERR_NICKNAMEINUSE,
+        '_ERRONEUSNICKNAME': Error.ERR_ERRONEUSNICKNAME,
+        '_NOSUCHCHANNEL': Error.ERR_NOSUCHCHANNEL,
+        '_NOTONCHANNEL': Error.ERR_NOTONCHANNEL,
+        '_NEEDMOREPARAMS': Error.ERR_NEEDMOREPARAMS,
+        '_NOTREGISTERED': Error.ERR_NOTREGISTERED,
+        '_INPUTTOOLONG': Error.ERR_INPUTTOOLONG,
+        '_ALREADYREGISTRED': Error.ERR_ALREADYREGISTRED,
+        '_UMODEUNKNOWNFLAG': Error.ERR_UMODEUNKNOWNFLAG,
+        '_USERSDONTMATCH': Error.ERR_USERSDONTMATCH,
+        '_UMODEIS': Response.RPL_UMODEIS,
+        '_TOPIC': Response.RPL_TOPIC,
+        '_NAMREPLY': Response.RPL_NAMREPLY,
+        '_ENDOFNAMES': Response.RPL_ENDOFNAMES,
+        '_LISTSTART': Response.RPL_LISTSTART,
+        '_LIST': Response.RPL_LIST,
+        '_LISTEND': Response.RPL_LISTEND,
+        '_WHOREPLY': Response.RPL_WHOREPLY,
+        '_ENDOFWHO': Response.RPL_ENDOFWHO,
+        '_WHOISUSER': Response.RPL_WHOISUSER,
+        '_WHOISSERVER': Response.RPL_WHOISSERVER,
+        '_WHOISCHANNELS': Response.RPL_WHOISCHANNELS,
+        '_ENDOFWHOIS': Response.RPL_ENDOFWHOIS,
+        '_STATSLINKINFO': Response.RPL_STATSLINKINFO,
+        '_STATSCOMMANDS': Response.RPL_STATSCOMMANDS,
+        '_STATSUPTIME': Response.RPL_STATSUPTIME,
+        '_STATSDEBUG': Response.RPL_STATSDEBUG,
+        '_ENDOFSTATS': Response.RPL_ENDOFSTATS,
+    }
+
+    HANDSHAKE = [  # Protocol
+                   'PING :kek',
+
+                   ":{server} {RPL_WELCOME} {nick} :-- Welcome to qtmost server, {nick}",
+                   ":{server} {RPL_YOURHOST} {nick} :-- You're connecting from a host, most likely",
+                   ":{server} {RPL_CREATED} {nick} :-- This server was created",
+                   ":{server} {RPL_MYINFO} {nick} :-- Your information",
+
+                   # MOTD
+                   ":{server} {RPL_MOTDSTART} {nick} :=== Begin super important guide to optimal happiness ===",
+                   ":{server} {RPL_MOTD} {nick} :|                                                      |",
+                   ":{server} {RPL_MOTD} {nick} :|  Remember to stay qt.                                |",
+                   ":{server} {RPL_MOTD} {nick} :|                                                      |",
+                   ":{server} {RPL_ENDOFMOTD} {nick} :=== End super important guide to optimal happiness ====="]
+
+    @staticmethod
+    def setserver(name):
+        """
+        Makes name the server our numerics come from, and puts together every numeric prefix and the handshake
+        (with everything but the nick filled in, split where the nick goes) with it.
+        The IRCFactory calls this with its name, there's one server per process.
+
+        :type name: str
+        """
+
+        Protocol.SERVER = name
+        for attribute, numeric in Protocol._NUMERICS.items():
+            setattr(Protocol, attribute, ':' + name + ' ' + numeric + ' ')
+        Protocol._HANDSHAKE = [line.format(server=name, nick='{nick}', **Response.todict()).split('{nick}')
+                               for line in Protocol.HANDSHAKE]
+
     @staticmethod
-    def privmsg(client, channel, message):
+    def encode(line):
+        """
+        Turns a line into what actually goes over the wire.
+        Do this once per message, not once per recipient.
+
+        :type line: str
+        :rtype: bytes
+        """
+
+        return (line + '\r\n').encode()
+
+    @staticmethod
+    def privmsg(client, target, message):
         """
         Returns a privmsg command
 
         :type client: Client
-        :type channel: Channel
+        :type target: str
         :type message: str
         :rtype: str
         """
 
-        template = ":{identity} PRIVMSG {channel} :{message}"
-        return template.format(identity=client.identity,
-                               channel=channel.name,
-                               message=message)
+        return ':' + client.identity + ' PRIVMSG ' + target + ' :' + message
+
+    @staticmethod
+    def notice(client, target, message):
+        """
+        Returns a notice command
+
+        :type client: Client
+        :type target: str
+        :type message: str
+        :rtype: str
+        """
+
+        return ':' + client.identity + ' NOTICE ' + target + ' :' + message
 
     @staticmethod
     def quit(client, reason="Quit"):
@@ -40,9 +134,7 @@ class Protocol:
         :rtype: str
         """
 
-        template = ":{identity} QUIT :{reason}"
-        return template.format(identity=client.identity,
-                               reason=reason)
+        return ':' + client.identity + ' QUIT :' + reason
 
     @staticmethod
     def part(client, channel, reason="Leaving"):
@@ -54,10 +146,7 @@ class Protocol:
         :rtype: str
         """
 
-        template = ":{identity} PART {channel} :{reason}"
-        return template.format(identity=client.identity,
-                               channel=channel.name,
-                               reason=reason)
+        return ':' + client.identity + ' PART ' + channel.name + ' :' + reason
 
     @staticmethod
     def join(client, channel):
@@ -69,9 +158,195 @@ class Protocol:
         :rtype: str
         """
 
-        template = ":{identity} JOIN {channel}"
-        return template.format(channel=channel.name,
-                               identity=client.identity)
+        return ':' + client.identity + ' JOIN ' + channel.name
+
+    @staticmethod
+    def topic(client, channel):
+        """
+        Returns RPL_TOPIC, telling client what channel's topic is
+
+        :type client: Client
+        :type channel: Channel
+        :rtype: str
+        """
+
+        return Protocol._TOPIC + client.nick + ' ' + channel.name + ' :' + channel.topic
+
+    @staticmethod
+    def names(client, channel, nicks):
+        """
+        Returns RPL_NAMREPLY, telling client who's in channel
+
+        :type client: Client
+        :type channel: Channel
+        :type nicks: str
+        :rtype: str
+        """
+
+        return Protocol._NAMREPLY + client.nick + ' = ' + channel.name + ' :' + nicks
+
+    @staticmethod
+    def liststart(client):
+        """
+        Returns RPL_LISTSTART, which goes before the first RPL_LIST
+
+        :type client: Client
+        :rtype: str
+        """
+
+        return Protocol._LISTSTART + client.nick + ' Channel :Users  Name'
+
+    @staticmethod
+    def list(client, channel, users):
+        """
+        Returns RPL_LIST, telling client how many users are in channel, and its topic
+
+        :type client: Client
+        :type channel: Channel
+        :type users: int
+        :rtype: str
+        """
+
+        return Protocol._LIST + client.nick + ' ' + channel.name + ' ' + str(users) + ' :' + channel.topic
+
+    @staticmethod
+    def listend(client):
+        """
+        Returns RPL_LISTEND, which goes after the last RPL_LIST
+
+        :type client: Client
+        :rtype: str
+        """
+
+        return Protocol._LISTEND + client.nick + ' :End of /LIST'
+
+    @staticmethod
+    def who(client, channame, member, server, status, hops):
+        """
+        Returns RPL_WHOREPLY, telling client about member. channame is a channel they're both in, or *.
+        status is H (or G, if they're away) and their prefix in the channel, if they have one.
+
+        :type client: Client
+        :type channame: str
+        :type member: Client
+        :type server: str
+        :type status: str
+        :type hops: int
+        :rtype: str
+        """
+
+        # There's a line like this for every member of a channel, and join() is a lot quicker than + for this many
+        return ''.join((Protocol._WHOREPLY, client.nick, ' ', channame, ' ~', member.user, ' ', member.host, ' ',
+                        server, ' ', member.nick, ' ', status, ' :', str(hops), ' ', member.name))
+
+    @staticmethod
+    def endofwho(client, mask):
+        """
+        Returns RPL_ENDOFWHO, which goes after the last RPL_WHOREPLY
+
+        :type client: Client
+        :type mask: str
+        :rtype: str
+        """
+
+        return Protocol._ENDOFWHO + client.nick + ' ' + mask + ' :End of /WHO list.'
+
+    @staticmethod
+    def namesroom(channame, nicklen):
+        """
+        How many bytes of nicks fit in one RPL_NAMREPLY for channame, to a client whose nick is nicklen long
+
+        :type channame: str
+        :type nicklen: int
+        :rtype: int
+        """
+
+        return 510 - len((Protocol._NAMREPLY + ' = ' + channame + ' :').encode('utf-8')) - nicklen
+
+    @staticmethod
+    def endofnames(client, channame):
+        """
+        Returns RPL_ENDOFNAMES, which goes after the last RPL_NAMREPLY
+
+        :type client: Client
+        :type channame: str
+        :rtype: str
+        """
+
+        return Protocol._ENDOFNAMES + client.nick + ' ' + channame + ' :End of /NAMES list.'
+
+    @staticmethod
+    def statslinkinfo(client, name, sendq, sentmessages, sentbytes, receivedmessages, receivedbytes, timeopen):
+        """
+        Returns RPL_STATSLINKINFO, one connection's traffic for STATS l
+
+        :type client: Client
+        :type name: str
+        :type sendq: int
+        :type sentmessages: int
+        :type sentbytes: int
+        :type receivedmessages: int
+        :type receivedbytes: int
+        :type timeopen: float
+        :rtype: str
+        """
+
+        return (Protocol._STATSLINKINFO + client.nick + ' ' + name + ' ' + str(sendq) + ' ' + str(sentmessages) + ' ' +
+                str(sentbytes // 1024) + ' ' + str(receivedmessages) + ' ' + str(receivedbytes // 1024) + ' ' +
+                str(int(timeopen)))
+
+    @staticmethod
+    def statscommands(client, command, count):
+        """
+        Returns RPL_STATSCOMMANDS, how many times a command has been used, for STATS m
+
+        :type client: Client
+        :type command: str
+        :type count: int
+        :rtype: str
+        """
+
+        return Protocol._STATSCOMMANDS + client.nick + ' ' + command + ' ' + str(count) + ' 0 0'
+
+    @staticmethod
+    def statsuptime(client, seconds):
+        """
+        Returns RPL_STATSUPTIME, for STATS u
+
+        :type client: Client
+        :type seconds: float
+        :rtype: str
+        """
+
+        minutes, seconds = divmod(int(seconds), 60)
+        hours, minutes = divmod(minutes, 60)
+        days, hours = divmod(hours, 24)
+        return Protocol._STATSUPTIME + client.nick + ' :Server Up {days} days {hours}:{minutes:02}:{seconds:02}'.format(
+            days=days, hours=hours, minutes=minutes, seconds=seconds)
+
+    @staticmethod
+    def statsdebug(client, text):
+        """
+        Returns RPL_STATSDEBUG, free-form STATS output
+
+        :type client: Client
+        :type text: str
+        :rtype: str
+        """
+
+        return Protocol._STATSDEBUG + client.nick + ' :' + text
+
+    @staticmethod
+    def endofstats(client, query):
+        """
+        Returns RPL_ENDOFSTATS, which goes after the last line of any STATS reply
+
+        :type client: Client
+        :type query: str
+        :rtype: str
+        """
+
+        return Protocol._ENDOFSTATS + client.nick + ' ' + query + ' :End of STATS report'
 
     @staticmethod
     def pong():
@@ -83,32 +358,191 @@ class Protocol:
 
         return 'PONG'
 
+    @staticmethod
+    def ping():
+        """
+        PING! For clients that have gone quiet, they'd better PONG back.
+
+        :rtype: str
+        """
+
+        return 'PING :' + Protocol.SERVER
+
+    @staticmethod
+    def error(reason):
+        """
+        Returns an ERROR command, the last thing a client hears before we close the connection
+
+        :type reason: str
+        :rtype: str
+        """
+
+        return 'ERROR :' + reason
+
+    @staticmethod
+    def nosuchnick(client, target):
+        """
+        Returns ERR_NOSUCHNICK, for when a message is sent to a nick or channel that doesn't exist
+
+        :type client: Client
+        :type target: str
+        :rtype: str
+        """
+
+        return Protocol._NOSUCHNICK + client.nick + ' ' + target + ' :No such nick/channel'
+
+    @staticmethod
+    def nicknameinuse(client, nick):
+        """
+        Returns ERR_NICKNAMEINUSE, for when a client wants a nick someone else has
+
+        :type client: Client
+        :type nick: str
+        :rtype: str
+        """
+
+        return Protocol._NICKNAMEINUSE + client.nick + ' ' + nick + ' :Nickname is already in use'
+
+    @staticmethod
+    def erroneusnickname(client, nick):
+        """
+        Returns ERR_ERRONEUSNICKNAME, for when a client wants a nick they can't have, like someone's uid
+
+        :type client: Client
+        :type nick: str
+        :rtype: str
+        """
+
+        return Protocol._ERRONEUSNICKNAME + client.nick + ' ' + nick + ' :Erroneous nickname'
+
+    @staticmethod
+    def nosuchchannel(client, channame):
+        """
+        Returns ERR_NOSUCHCHANNEL, for when a client tries to do something in a channel that doesn't exist
+
+        :type client: Client
+        :type channame: str
+        :rtype: str
+        """
+
+        return Protocol._NOSUCHCHANNEL + client.nick + ' ' + channame + ' :No such channel'
+
+    @staticmethod
+    def notonchannel(client, channame):
+        """
+        Returns ERR_NOTONCHANNEL, for when a client tries to do something in a channel they're not in
+
+        :type client: Client
+        :type channame: str
+        :rtype: str
+        """
+
+        return Protocol._NOTONCHANNEL + client.nick + ' ' + channame + " :You're not on that channel"
+
+    @staticmethod
+    def needmoreparams(client, command):
+        """
+        Returns ERR_NEEDMOREPARAMS, for when a command is missing parameters
+
+        :type client: Client
+        :type command: str
+        :rtype: str
+        """
+
+        return Protocol._NEEDMOREPARAMS + client.nick + ' ' + command + ' :Not enough parameters'
+
+    @staticmethod
+    def notregistered(client, command):
+        """
+        Returns ERR_NOTREGISTERED, for when a client uses a command before NICK and USER
+
+        :type client: Client
+        :type command: str
+        :rtype: str
+        """
+
+        return Protocol._NOTREGISTERED + client.nick + ' ' + command + ' :You have not registered'
+
+    @staticmethod
+    def inputtoolong(client):
+        """
+        Returns ERR_INPUTTOOLONG, for when a client sends a line that's longer than we allow
+
+        :type client: Client
+        :rtype: str
+        """
+
+        return Protocol._INPUTTOOLONG + client.nick + ' :Input line was too long'
+
+    @staticmethod
+    def umodeunknownflag(client):
+        """
+        Returns ERR_UMODEUNKNOWNFLAG, for when a client tries to set a user mode we don't have
+
+        :type client: Client
+        :rtype: str
+        """
+
+        return Protocol._UMODEUNKNOWNFLAG + client.nick + ' :Unknown MODE flag'
+
+    @staticmethod
+    def usersdontmatch(client):
+        """
+        Returns ERR_USERSDONTMATCH, for when a client tries to see or change someone else's user modes
+
+        :type client: Client
+        :rtype: str
+        """
+
+        return Protocol._USERSDONTMATCH + client.nick + " :Can't change mode for other users"
+
+    @staticmethod
+    def umodeis(client):
+        """
+        Returns RPL_UMODEIS, telling client what their user modes are
+
+        :type client: Client
+        :rtype: str
+        """
+
+        return Protocol._UMODEIS + client.nick + ' +' + client.mode
+
+    @staticmethod
+    def usermode(client, change):
+        """
+        Tells client their user modes changed, and how
+
+        :type client: Client
+        :type change: str
+        :rtype: str
+        """
+
+        return ':' + client.nick + ' MODE ' + client.nick + ' :' + change
+
+    @staticmethod
+    def alreadyregistered(client):
+        """
+        Returns ERR_ALREADYREGISTRED, for when a client sends USER twice
+
+        :type client: Client
+        :rtype: str
+        """
+
+        return Protocol._ALREADYREGISTRED + client.nick + ' :You may not reregister'
+
     @staticmethod
     def handshake(client):
         """
         When a client connects, it tells us who it is, and then we respond with some welcoming stuff.
+        The lines are in HANDSHAKE, and all that's left to do here is put the nick in.
         TODO: This isn't generic at all, needs fix.
 
         :type client: Client
         :rtype: [str, ...]
         """
 
-        response = [  # Protocol
-                      'PING :kek',
-
-                      ":localhost {RPL_WELCOME} {nick} :-- Welcome to qtmost server, {nick}",
-                      ":localhost {RPL_YOURHOST} {nick} :-- You're connecting from a host, most likely",
-                      ":localhost {RPL_CREATED} {nick} :-- This server was created",
-                      ":localhost {RPL_MYINFO} {nick} :-- Your information",
-
-                      # MOTD
-                      ":localhost {RPL_MOTDSTART} {nick} :=== Begin super important guide to optimal happiness ===",
-                      ":localhost {RPL_MOTD} {nick} :|                                                      |",
-                      ":localhost {RPL_MOTD} {nick} :|  Remember to stay qt.                                |",
-                      ":localhost {RPL_MOTD} {nick} :|                                                      |",
-                      ":localhost {RPL_ENDOFMOTD} {nick} :=== End super important guide to optimal happiness ====="]
-
-        return [line.format(nick=client.nick, **Response.todict()) for line in response]
+        nick = client.nick
+        return [nick.join(pieces) for pieces in Protocol._HANDSHAKE]
 
     # Nick
     class Nick:
@@ -119,13 +553,66 @@ class Protocol:
 
         @staticmethod
         def response(oldnick, newnick):
-            template = ":{oldnick} NICK {newnick}"
-            return template.format(oldnick=oldnick, newnick=newnick)
+            return ':' + oldnick + ' NICK ' + newnick
 
         @staticmethod
         def announce(client, newnick):
-            template = ":{identity} NICK {newnick}"
-            return template.format(identity=client.identity, newnick=newnick)
+            return ':' + client.identity + ' NICK ' + newnick
+
+    # Link
+    class Link:
+        """
+        Subclass to Protocol.
+        Groups the lines servers (and worker processes) send each other. They look like IRC and are read with
+        Message.parse, but users are named by uid instead of nick, so a nick change in flight can't misroute anything.
+
+        SERVER <sid> <name>
+        :<sid> UID <uid> <nick> <ts> <user> <host> :<name>
+        :<uid> NICK <nick> <ts>
+        :<uid> JOIN <channel>
+        :<uid> PART <channel> :<reason>
+        :<uid> QUIT :<reason>
+        :<uid> PRIVMSG <channel or uid> :<message>
+        :<uid> NOTICE <channel or uid> :<message>
+        :<sid> SQUIT <sid> :<reason>
+        """
+
+        @staticmethod
+        def server(sid, name):
+            return 'SERVER ' + sid + ' ' + name
+
+        @staticmethod
+        def uid(sid, client):
+            return (':' + sid + ' UID ' + client.uid + ' ' + client.nick + ' ' + str(client.ts) + ' ' +
+                    client.user + ' ' + client.host + ' :' + client.name)
+
+        @staticmethod
+        def nick(client, newnick):
+            return ':' + client.uid + ' NICK ' + newnick + ' ' + str(client.ts)
+
+        @staticmethod
+        def join(client, channel):
+            return ':' + client.uid + ' JOIN ' + channel.name
+
+        @staticmethod
+        def part(client, channel, reason):
+            return ':' + client.uid + ' PART ' + channel.name + ' :' + reason
+
+        @staticmethod
+        def quit(client, reason):
+            return ':' + client.uid + ' QUIT :' + reason
+
+        @staticmethod
+        def privmsg(client, target, message):
+            return ':' + client.uid + ' PRIVMSG ' + target + ' :' + message
+
+        @staticmethod
+        def notice(client, target, message):
+            return ':' + client.uid + ' NOTICE ' + target + ' :' + message
+
+        @staticmethod
+        def squit(sid, server, reason):
+            return ':' + sid + ' SQUIT ' + server + ' :' + reason
 
     # Whois
     class Whois:
@@ -142,33 +629,66 @@ class Protocol:
         # b':cameron.freenode.net 330 yukarin qtfriend QTFriend :is logged in as'
 
         @staticmethod
-        def whoisuser():
+        def whoisuser(client, target):
             """
             RPL_WHOISUSER
             b':cameron.freenode.net 311 yukarin qtfriend ~qtfriend unaffiliated/qtfriend * :some qt'
+
+            :type client: Client
+            :type target: Client
+            :rtype: str
             """
-            pass
+            return (Protocol._WHOISUSER + client.nick + ' ' + target.nick + ' ~' + target.user + ' ' + target.host +
+                    ' * :' + target.name)
 
         @staticmethod
-        def whoischannels():
+        def whoischannels(client, target, channels):
             """
             RPL_WHOISCHANNELS
             b':cameron.freenode.net 319 yukarin qtfriend :#blah #otherchan '
+
+            :type client: Client
+            :type target: Client
+            :type channels: str
+            :rtype: str
             """
-            pass
+            return Protocol._WHOISCHANNELS + client.nick + ' ' + target.nick + ' :' + channels
 
         @staticmethod
-        def whoisserver():
+        def channelsroom(client, target):
+            """
+            How many bytes of channel names fit in one RPL_WHOISCHANNELS about target
+
+            :type client: Client
+            :type target: Client
+            :rtype: int
+            """
+            return 510 - len(Protocol.Whois.whoischannels(client, target, '').encode('utf-8'))
+
+        @staticmethod
+        def whoisserver(client, target, server):
             """
             RPL_WHOISSERVER
             b':cameron.freenode.net 312 yukarin qtfriend sendak.freenode.net :Vilnius, Lithuania, EU'
+
+            :type client: Client
+            :type target: Client
+            :type server: str
+            :rtype: str
             """
-            pass
+            return Protocol._WHOISSERVER + client.nick + ' ' + target.nick + ' ' + server + ' :' + Protocol.SERVERINFO
 
         @staticmethod
-        def endofwhois():
+        def endofwhois(client, nick):
             """
             RPL_ENDOFWHOIS
             b':cameron.freenode.net 318 yukarin qtfriend :End of /WHOIS list.'
+
+            :type client: Client
+            :type nick: str
+            :rtype: str
             """
-            pass
+            return Protocol._ENDOFWHOIS + client.nick + ' ' + nick + ' :End of /WHOIS list.'
+
+
+Protocol.setserver(Protocol.SERVER)
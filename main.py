@@ -1,55 +1,276 @@
-from twisted.internet import reactor
+import argparse
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
 
+from system import workers
+from system.bus import Bus
 from system.clientconnection import ClientConnection
 from system.hooks import handle_user, handle_nick, handle_ping, handle_pong, handle_join, handle_part, \
-    handle_privmsg, handle_mode
+    handle_names, handle_list, handle_privmsg, handle_notice, handle_mode, handle_stats, \
+    handle_who, handle_whois, handle_quit
 from system.ircfactory import IRCFactory
+from system.link import LinkFactory, LinkServerFactory
 from system.messagehandler import MessageHandler
 from util import logger
 
-logger.debugmode = True
+logger.configure(logger.DEBUG)
+
+LOGLEVELS = {'debug': logger.DEBUG, 'info': logger.INFO, 'warn': logger.WARN}
 
 
 def addhooks():
     """
-    This is a temporary solution for hooking regexes up to various functions.
+    This is a temporary solution for hooking commands up to various functions.
     It'll look pretty much like this in the future too, but it won't be right here,
     and it'll be built in such a way that you can easily make plugins.
     """
 
-    MessageHandler.addhook('^PRIVMSG (?P<channel>[^\s]+) :(?P<message>.*)', handle_privmsg)
+    MessageHandler.addhook('PRIVMSG', handle_privmsg, minparams=2)
+    MessageHandler.addhook('NOTICE', handle_notice, minparams=2)
+
+    MessageHandler.addhook('PING', handle_ping, registered=False)
+    MessageHandler.addhook('PONG', handle_pong, registered=False)
+
+    MessageHandler.addhook('NICK', handle_nick, minparams=1, registered=False)
+    MessageHandler.addhook('USER', handle_user, minparams=4, registered=False)
+    MessageHandler.addhook('QUIT', handle_quit, registered=False)
+
+    MessageHandler.addhook('JOIN', handle_join, minparams=1)
+    MessageHandler.addhook('PART', handle_part, minparams=1)
+    MessageHandler.addhook('NAMES', handle_names)
+    MessageHandler.addhook('LIST', handle_list)
+    MessageHandler.addhook('WHO', handle_who)
+    MessageHandler.addhook('WHOIS', handle_whois, minparams=1)
+
+    MessageHandler.addhook('MODE', handle_mode, minparams=1)
+
+    MessageHandler.addhook('STATS', handle_stats)
+
+
+def sid(value):
+    """
+    Checks a --sid.
+
+    :type value: str
+    :rtype: str
+    """
+    if len(value) != 3 or not value[0].isalpha() or not value.isalnum():
+        raise argparse.ArgumentTypeError('a sid is three letters or digits, starting with a letter')
+    return value.upper()
 
-    MessageHandler.addhook('^PING.*', handle_ping)
-    MessageHandler.addhook('^PONG.*', handle_pong)
 
-    MessageHandler.addhook('^NICK (?P<nick>.*)',
-                           handle_nick)
+def installreactor(loop):
+    """
+    Picks the event loop everything runs on. With asyncio or uvloop, Twisted runs on top of that same loop,
+    so links and the metrics endpoint work no matter which one clients are served by.
+    Returns the reactor, and the asyncio event loop if there is one.
 
-    MessageHandler.addhook('^USER (?P<user>[^\s]+)'
-                           ' (?P<mode>[^\s]+)'
-                           ' (?P<host>[^\s]+)'
-                           ' :(?P<name>.*)',
-                           handle_user)
+    :type loop: str
+    :rtype: (twisted.internet.interfaces.IReactorCore, asyncio.AbstractEventLoop | None)
+    """
+    if loop == 'twisted':
+        from twisted.internet import reactor
+        return reactor, None
 
-    MessageHandler.addhook('^JOIN (?P<channels>.*)', handle_join)
-    MessageHandler.addhook('^PART (?P<channel>[^\s]+)( :(?P<message>.*))?', handle_part)
+    import asyncio
+    if loop == 'uvloop':
+        import uvloop
+        eventloop = uvloop.new_event_loop()
+    else:
+        eventloop = asyncio.new_event_loop()
+    asyncio.set_event_loop(eventloop)
 
-    MessageHandler.addhook('^MODE (?P<nick>[^\s]+) (?P<mode>.*)', handle_mode)
+    from twisted.internet import asyncioreactor
+    asyncioreactor.install(eventloop)
+    from twisted.internet import reactor
+    return reactor, eventloop
 
 
 def main():
+    parser = argparse.ArgumentParser(description='kawaiirc, an IRC server')
+    parser.add_argument('--port', type=int, default=6667, help='port to listen for clients on')
+    parser.add_argument('--loop', choices=('twisted', 'asyncio', 'uvloop'), default='twisted',
+                        help='the event loop clients are served by')
+    parser.add_argument('--log-level', choices=sorted(LOGLEVELS), default='debug', help='how much to log')
+    parser.add_argument('--log-file', help='log to this file instead of stdout, starting a new one when it gets big '
+                                           '(workers each log to their own, with their sid in the name)')
+    parser.add_argument('--log-json', action='store_true', help='log JSON lines instead of plain text')
+    parser.add_argument('--metrics-port', type=int, help='serve metrics over HTTP on this port, on localhost only')
+    parser.add_argument('--profile-hooks', action='store_true',
+                        help='time every hook call from the start (SIGUSR1 switches it on and off at any time)')
+    parser.add_argument('--slow-hook', type=float, default=50.0,
+                        help='log hook calls that take longer than this many milliseconds while profiling')
+    parser.add_argument('--flood-rate', type=float, default=2.0,
+                        help='how many commands a second a client may send once its burst is used up, 0 to allow any')
+    parser.add_argument('--flood-burst', type=float, default=20.0,
+                        help='how many commands a client may send in a row before --flood-rate kicks in')
+    parser.add_argument('--flood-queue', type=int, default=64,
+                        help='how many commands may wait for their turn before a client is dropped for flooding')
+    parser.add_argument('--registration-timeout', type=float, default=60.0,
+                        help='drop clients that haven\'t sent NICK and USER after this many seconds, 0 to never')
+    parser.add_argument('--ping-interval', type=float, default=120.0,
+                        help='ping clients that have been quiet for this many seconds, 0 to never')
+    parser.add_argument('--ping-timeout', type=float, default=60.0,
+                        help='drop clients that haven\'t answered a ping after this many seconds')
+    parser.add_argument('--keep-channel', action='append', default=[], metavar='CHANNEL',
+                        help='a channel that stays around while it\'s empty, can be given more than once')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='run this many worker processes sharing the port, to use more than one core')
+    parser.add_argument('--bus', help='the Unix socket workers talk to each other on (a private one if not given)')
+    parser.add_argument('--sid', type=sid, default='K00',
+                        help='this server\'s id on the network, three letters or digits starting with a letter')
+    parser.add_argument('--name', help='what other servers call this one')
+    parser.add_argument('--link-port', type=int,
+                        help='port to accept links from other servers on, needs --link-password')
+    parser.add_argument('--link-interface', default='127.0.0.1',
+                        help='address to accept links on, the default only takes them from this machine')
+    parser.add_argument('--link', action='append', default=[], metavar='HOST:PORT',
+                        help='link to the server there, can be given more than once')
+    parser.add_argument('--link-password', help='what linked servers have to say to each other first')
+    parser.add_argument('--link-keepalive', type=float, default=60.0,
+                        help='ping linked servers after this many idle seconds, drop them after twice that')
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)  # set by the supervisor
+    parser.add_argument('--listen-fd', type=int, help=argparse.SUPPRESS)  # same
+    args = parser.parse_args()
+
+    logger.configure(LOGLEVELS[args.log_level], path=args.log_file, asjson=args.log_json)
+
+    try:
+        reactor, eventloop = installreactor(args.loop)
+    except ImportError:
+        parser.error('--loop {loop} needs {loop} installed'.format(loop=args.loop))
+
+    if args.workers > workers.MAX_WORKERS:
+        parser.error('--workers can be at most {most}'.format(most=workers.MAX_WORKERS))
+
+    if args.workers > 0 and (args.link or args.link_port is not None):
+        parser.error('--workers can\'t be used together with --link or --link-port yet')
+
+    if args.link_port is not None and not args.link_password:
+        parser.error('--link-port needs a --link-password, or anyone who can reach it can speak for the network')
+
+    if args.workers > 0:
+        supervise(args, reactor)
+        return
+
+    MessageHandler.setprofiling(args.profile_hooks, slow=args.slow_hook / 1000)
+    if hasattr(signal, 'SIGUSR1'):
+        # Only schedule it, the signal can arrive while the logger's queue is locked and setprofiling logs
+        signal.signal(signal.SIGUSR1, lambda signum, frame: reactor.callFromThread(
+            lambda: MessageHandler.setprofiling(not MessageHandler.PROFILING)))
+
     logger.info("Adding hooks...")
     addhooks()
     logger.info("Done with hooks!")
 
     logger.info("Setting up factory")
-    factory = IRCFactory()
-    factory.protocol = ClientConnection
+    serverid = args.sid if args.worker is None else workers.workersid(args.worker)
+    if eventloop is None:
+        factory = IRCFactory(sid=serverid, name=args.name, floodrate=args.flood_rate, floodburst=args.flood_burst,
+                             floodqueue=args.flood_queue, registertimeout=args.registration_timeout,
+                             pinginterval=args.ping_interval, pingtimeout=args.ping_timeout,
+                             keepchannels=args.keep_channel)
+        factory.protocol = ClientConnection
+    else:
+        from system import asyncioconnection
+        factory = IRCFactory(reactor=asyncioconnection.AsyncioClock(eventloop), sid=serverid,
+                             name=args.name, floodrate=args.flood_rate, floodburst=args.flood_burst,
+                             floodqueue=args.flood_queue, registertimeout=args.registration_timeout,
+                             pinginterval=args.ping_interval, pingtimeout=args.ping_timeout,
+                             keepchannels=args.keep_channel)
+
+    logger.info("Listening on the {loop} loop", loop=args.loop)
+    if eventloop is not None:
+        sock = None
+        if args.listen_fd is not None:
+            sock = socket.socket(fileno=args.listen_fd)
+        elif args.worker is not None:
+            sock = workers.bindsocket(args.port)
+        eventloop.run_until_complete(asyncioconnection.serve(eventloop, factory, port=args.port, sock=sock))
+    elif args.worker is None:
+        reactor.listenTCP(args.port, factory)
+    else:
+        workers.listen(reactor, args.port, factory, fd=args.listen_fd)
+
+    if args.worker is not None:
+        reactor.connectUNIX(args.bus, LinkFactory(factory))
+        workers.watchparent(reactor)
+
+    if args.link_port is not None:
+        logger.info("Accepting server links on {interface}:{port}", interface=args.link_interface, port=args.link_port)
+        reactor.listenTCP(args.link_port, LinkServerFactory(factory, args.link_password, args.link_keepalive),
+                          interface=args.link_interface)
+
+    for address in args.link:
+        host, _, port = address.rpartition(':')
+        logger.info("Linking to {host}:{port}", host=host, port=port)
+        reactor.connectTCP(host, int(port), LinkFactory(factory, args.link_password, args.link_keepalive))
+
+    if args.metrics_port is not None:
+        from system import metricsendpoint
+        port = args.metrics_port + (args.worker - 1 if args.worker is not None else 0)
+        logger.info("Serving metrics on localhost:{port}", port=port)
+        reactor.listenTCP(port, metricsendpoint.site(factory), interface='127.0.0.1')
+
+    reactor.run()
+
+
+def supervise(args, reactor):
+    """
+    Runs the bus and args.workers workers, each started with the same arguments as we were.
+    Worker n serves its metrics on --metrics-port + n - 1.
+
+    :type args: argparse.Namespace
+    :type reactor: twisted.internet.interfaces.IReactorCore
+    """
+    path = args.bus
+    if path is None:
+        # Anyone who can connect to the bus can talk for a worker, so ours goes where only we can get at it
+        busdir = tempfile.mkdtemp(prefix='kawaiirc-')
+        reactor.addSystemEventTrigger('after', 'shutdown', shutil.rmtree, busdir, True)
+        path = os.path.join(busdir, 'bus')
+    logger.info("Bus is on {path}", path=path)
+    reactor.listenUNIX(path, Bus(), mode=0o600)
+
+    sock = None
+    if not workers.REUSEPORT:
+        sock = workers.bindsocket(args.port, reuseport=False)
+        sock.set_inheritable(True)
+
+    def argv(number):
+        result = [sys.executable, os.path.abspath(__file__), '--port', str(args.port), '--bus', path,
+                  '--worker', str(number), '--slow-hook', str(args.slow_hook), '--loop', args.loop,
+                  '--log-level', args.log_level, '--flood-rate', str(args.flood_rate),
+                  '--flood-burst', str(args.flood_burst), '--flood-queue', str(args.flood_queue),
+                  '--registration-timeout', str(args.registration_timeout),
+                  '--ping-interval', str(args.ping_interval), '--ping-timeout', str(args.ping_timeout)]
+        if args.name is not None:
+            result += ['--name', args.name]
+        if args.log_file is not None:
+            # A file rotated by several processes at once would lose lines, so every worker gets its own
+            root, extension = os.path.splitext(args.log_file)
+            result += ['--log-file', root + '-' + workers.workersid(number) + extension]
+        if args.log_json:
+            result.append('--log-json')
+        if args.metrics_port is not None:
+            result += ['--metrics-port', str(args.metrics_port)]
+        for channame in args.keep_channel:
+            result += ['--keep-channel', channame]
+        if args.profile_hooks:
+            result.append('--profile-hooks')
+        if sock is not None:
+            result += ['--listen-fd', str(sock.fileno())]
+        return result
 
-    logger.info("Listening")
-    reactor.listenTCP(6667, factory)
+    supervisor = workers.Supervisor(reactor, args.workers, argv, fd=sock.fileno() if sock is not None else None)
+    reactor.callWhenRunning(supervisor.start)
+    reactor.addSystemEventTrigger('before', 'shutdown', supervisor.stop)
     reactor.run()
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,160 @@
+"""
+The asyncio side of a client connection, for running the server on asyncio (or uvloop) instead of Twisted.
+Connection does all the work, same as on Twisted. What's here is only what asyncio does differently:
+
+AsyncioConnection is an asyncio.Protocol that hands what comes in to Connection.
+AsyncioTransport makes an asyncio transport look enough like a Twisted one for Connection and its SendQueue,
+and passes asyncio's pause_writing and resume_writing on to the SendQueue.
+AsyncioClock gives IRCFactory (and everything that asks it for the time or a callLater) the event loop's timers.
+
+Twisted can still run on the same event loop (see main.py), for server links and the metrics endpoint.
+"""
+
+from builtins import super
+import asyncio
+import time
+
+from system.connection import Connection
+
+
+class AsyncioCall:
+    """
+    What AsyncioClock.callLater returns, it acts like Twisted's IDelayedCall as far as we need it to.
+    """
+
+    __slots__ = ('_handle', '_time', '_func', '_args', '_kw', '_called')
+
+    def __init__(self, loop, delay, func, args, kw):
+        self._time = time.time() + delay
+        self._func = func
+        self._args = args
+        self._kw = kw
+        self._called = False
+        self._handle = loop.call_later(delay, self._run) if delay > 0 else loop.call_soon(self._run)
+
+    def _run(self):
+        self._called = True
+        self._func(*self._args, **self._kw)
+
+    def active(self):
+        return not (self._called or self._handle.cancelled())
+
+    def cancel(self):
+        self._handle.cancel()
+
+    def getTime(self):
+        return self._time
+
+
+class AsyncioClock:
+    """
+    An asyncio event loop, as an IReactorTime.
+    """
+
+    def __init__(self, loop):
+        """
+        :type loop: asyncio.AbstractEventLoop
+        """
+        self.loop = loop
+
+    def seconds(self):
+        """
+        :rtype: float
+        """
+        return time.time()
+
+    def callLater(self, delay, func, *args, **kw):
+        """
+        :type delay: float
+        :type func: function
+        :rtype: AsyncioCall
+        """
+        return AsyncioCall(self.loop, delay, func, args, kw)
+
+
+class AsyncioTransport:
+    """
+    An asyncio transport, with the Twisted names Connection uses.
+    """
+
+    def __init__(self, transport):
+        """
+        :type transport: asyncio.Transport
+        """
+        self._transport = transport
+        self.producer = None
+
+    @property
+    def disconnecting(self):
+        """
+        :rtype: bool
+        """
+        return self._transport.is_closing()
+
+    def write(self, data):
+        self._transport.write(data)
+
+    def writeSequence(self, data):
+        self._transport.writelines(data)
+
+    def loseConnection(self):
+        self._transport.close()
+
+    def abortConnection(self):
+        self._transport.abort()
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+    def getPeer(self):
+        return self._transport.get_extra_info('peername')
+
+
+class AsyncioConnection(Connection, asyncio.Protocol):
+    def __init__(self, factory):
+        """
+        :type factory: IRCFactory
+        """
+        super().__init__()
+        self.factory = factory
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = AsyncioTransport(transport)
+        self.connectionMade()
+
+    def connection_lost(self, exc):
+        self.connectionLost(exc)
+
+    def data_received(self, data):
+        """
+        :type data: bytes
+        """
+        self.dataReceived(data)
+
+    def pause_writing(self):
+        if self.transport.producer is not None:
+            self.transport.producer.pauseProducing()
+
+    def resume_writing(self):
+        if self.transport.producer is not None:
+            self.transport.producer.resumeProducing()
+
+
+def serve(loop, factory, port=None, sock=None):
+    """
+    Starts accepting clients for factory, on port or on an already listening sock. Returns a coroutine,
+    run it on the loop to get the asyncio.Server.
+
+    :type loop: asyncio.AbstractEventLoop
+    :type factory: IRCFactory
+    :type port: int
+    :type sock: socket.socket
+    :rtype: coroutine
+    """
+    if sock is not None:
+        return loop.create_server(lambda: AsyncioConnection(factory), sock=sock)
+    return loop.create_server(lambda: AsyncioConnection(factory), port=port)
@@ -0,0 +1,70 @@
+"""
+The bus is how worker processes on one machine talk to each other. It's a Unix socket that every worker
+connects a Link to, and it passes whatever one worker says on to all the others, without looking at it.
+All the work (bursts, nick collisions, who's in which channel) is done by the workers' Links,
+so to a worker the bus looks like one server with everyone else behind it.
+
+The one thing the bus does itself: when a worker's connection drops, it tells everyone else with SQUIT,
+so that worker's users don't hang around forever.
+"""
+
+from builtins import super
+
+from twisted.internet import protocol
+from twisted.protocols import basic
+
+from domain.protocol import Protocol
+from util import logger
+
+
+class BusConnection(basic.LineReceiver):
+    MAX_LENGTH = 65536
+
+    def __init__(self):
+        self.sid = None
+
+    def connectionMade(self):
+        self.factory.peers.append(self)
+
+    # noinspection PyMethodOverriding
+    def connectionLost(self, reason):
+        self.factory.peers.remove(self)
+        if self.sid is not None:
+            logger.warn("Worker {sid} left the bus", sid=self.sid)
+            self.factory.relay(self, Protocol.encode(Protocol.Link.squit(Bus.SID, self.sid, 'Worker is gone')))
+
+    def lineReceived(self, data):
+        """
+        :type data: bytes
+        """
+        if self.sid is None and data.startswith(b'SERVER '):
+            self.sid = data.split()[1].decode('utf-8', 'replace')
+            logger.info("Worker {sid} joined the bus", sid=self.sid)
+
+        self.factory.relay(self, data + self.delimiter)
+
+
+class Bus(protocol.ServerFactory):
+    """
+    Listen on a Unix socket with this, and point every worker's LinkFactory at it.
+    """
+
+    SID = 'K00'  # what the bus calls itself, when it has something to say
+
+    protocol = BusConnection
+
+    def __init__(self):
+        super().__init__()
+        self.peers = []
+
+    def relay(self, sender, data):
+        """
+        Writes data to every worker but the one that sent it.
+
+        :type sender: BusConnection
+        :type data: bytes
+        :rtype: None
+        """
+        for peer in self.peers:
+            if peer is not sender:
+                peer.transport.write(data)
@@ -0,0 +1,299 @@
+"""
+A Connection talks to a client, runs their messages through our hooks
+(by passing them to MessageHandler.handleline(...)) and returns
+responses, usually through the send method it shares with its client.
+
+Nothing is written to the transport right away. Outgoing data piles up in a SendQueue
+and goes out in one writeSequence at the end of the reactor tick (or after the factory's flushdelay),
+or as soon as there's more of it than the factory's flushsize.
+If a client stops reading and its sendq grows past the factory's maxsendq, we drop it.
+
+Incoming data is split into lines by a LineBuffer (see util.linebuffer), which decodes every line
+straight out of its buffer. A client that sends a line longer than the factory's maxline (plus maxtags
+for IRCv3 tags) gets ERR_INPUTTOOLONG, and the line is dropped.
+
+Every line a client sends has to get past the connection's FloodControl (see system.floodcontrol)
+before it's handled. Lines it can't pay for yet wait their turn, and a client that keeps flooding
+until too many are waiting gets dropped, like one whose sendq is exceeded. A factory with a floodrate of 0
+has no flood control.
+
+Clients that go quiet get a PING, and if they don't answer in time (or never finish registering),
+they're dropped, so dead connections don't stay in channels forever. Every connection has one timer for this
+on the factory's TimerWheel (see util.timerwheel), which it moves ahead instead of setting a new one.
+
+Every connection also counts what goes through it, for STATS and system.metrics.
+
+Connection itself doesn't know what event loop it's on. system.clientconnection runs it on Twisted,
+and system.asyncioconnection on asyncio.
+"""
+
+from builtins import *
+
+from domain.client import Client
+from domain.message import Message
+from system.floodcontrol import FloodControl
+from system.messagehandler import MessageHandler
+from system.metrics import Metrics
+from system.sendqueue import SendQueue
+from domain.protocol import Protocol
+from util import logger
+from util.linebuffer import LineBuffer
+
+
+class Connection:
+    """
+    Everything a client connection does that doesn't depend on the event loop under it.
+    Subclasses mix this with a protocol class, set self.factory and a Twisted-style self.transport
+    (write, writeSequence, loseConnection, abortConnection and registerProducer),
+    and then call connectionMade, dataReceived and connectionLost.
+    """
+
+    EVICT_TIMEOUT = 10  # seconds an evicted client gets to read its ERROR before we hang up on it
+
+    def __init__(self):
+        self._client = Client(sendfunc=self.send, writefunc=self.write, streamfunc=self.stream, quitfunc=self.quit)
+        self._sendq = None
+        self._evictcall = None
+        self._lines = None
+        self._flood = None
+        self._pinged = False
+        self._quitreason = "Connection lost"
+
+        self.since = None
+        self.lastseen = None
+        self.bytesin = 0
+        self.bytesout = 0
+        self.linesin = 0
+        self.writes = 0
+
+    @property
+    def client(self):
+        """
+        :rtype: Client
+        """
+        return self._client
+
+    @property
+    def sendqsize(self):
+        """
+        How many bytes are waiting to be sent to this client.
+
+        :rtype: int
+        """
+        return self._sendq.size if self._sendq is not None else 0
+
+    def connectionMade(self):
+        logger.info("Got new client!")
+        self.since = self.lastseen = self.factory.reactor.seconds()
+        self._client.uid = self.factory.nextuid()
+        Metrics.TOTALS['connections'] += 1
+        self._sendq = SendQueue(self.transport,
+                                self.factory.reactor,
+                                overflow=self.sendqexceeded,
+                                flushdelay=self.factory.flushdelay,
+                                flushsize=self.factory.flushsize,
+                                limit=self.factory.maxsendq)
+        self.transport.registerProducer(self._sendq, True)
+        self._lines = LineBuffer(self.factory.maxline, self.factory.maxtags)
+        if self.factory.floodrate > 0:
+            self._flood = FloodControl(self.factory.reactor,
+                                       handle=self.handle,
+                                       excess=self.floodexceeded,
+                                       rate=self.factory.floodrate,
+                                       burst=self.factory.floodburst,
+                                       limit=self.factory.floodqueue)
+        delay = self.factory.registertimeout or self.factory.pinginterval
+        if delay > 0:
+            self.factory.timers.schedule(self, delay, self.keepalive)
+        self.factory.clients.append(self)
+
+    # noinspection PyMethodOverriding
+    def connectionLost(self, reason):
+        logger.info('Lost client "{nick}"', nick=self._client.nick)
+        self._sendq.close()
+        if self._flood is not None:
+            self._flood.close()
+        if self._evictcall is not None and self._evictcall.active():
+            self._evictcall.cancel()
+        self.factory.timers.cancel(self)
+
+        self.factory.quit(self._client, self._quitreason)
+        self.factory.clients.remove(self)
+
+    def dataReceived(self, data):
+        """
+        Counts what came in, and handles every complete line in it.
+        We stop as soon as the client is on its way out, whatever else it sent is thrown away.
+
+        :type data: bytes
+        """
+        self.bytesin += len(data)
+        self.lastseen = self.factory.reactor.seconds()
+        Metrics.received(len(data))
+
+        for line in self._lines.feed(data):
+            if self.transport.disconnecting:
+                break
+
+            if line is LineBuffer.TOOLONG:
+                self.send(Protocol.inputtoolong(self._client))
+            else:
+                self.lineReceived(line)
+
+    def lineReceived(self, data):
+        """
+        :type data: str
+        """
+        self.linesin += 1
+        Metrics.TOTALS['lines_received'] += 1
+
+        if logger.isenabledfor(logger.DEBUG):
+            logger.debug('Recieved "{data}" from {nick}',
+                         nick=self._client.nick,
+                         data=data)
+
+        message = Message.parse(data)
+        if message is None:
+            return
+
+        if self._flood is None:
+            self.handle(message)
+        elif not self._flood.submit(message, FloodControl.cost(message, self.factory)):
+            Metrics.TOTALS['lines_throttled'] += 1
+
+    def handle(self, message):
+        """
+        Runs message through our hooks, and sends the client whatever they have to say back.
+        Lines that were waiting on flood control when the client started leaving are dropped.
+
+        :type message: Message
+        """
+        if self.transport.disconnecting:
+            return
+
+        response = MessageHandler.handleline(message, self._client, self.factory)
+        if response:
+            for data in response:
+                self.send(data)
+
+    def send(self, data):
+        """
+        :type data: str | [str, ...]
+        """
+
+        if type(data) in (list, tuple):
+            self.write(b''.join(Protocol.encode(line) for line in data))
+        else:
+            self.write(Protocol.encode(data))
+
+    def write(self, data):
+        """
+        :type data: bytes
+        """
+
+        if logger.isenabledfor(logger.DEBUG):
+            logger.debug('Sending "{data}" to {nick}',
+                         nick=self._client.nick,
+                         data=logger.Lazy(data.decode, 'utf-8', 'replace'))
+
+        if self._sendq is not None:
+            self.bytesout += len(data)
+            self.writes += 1
+            Metrics.sent(len(data))
+            self._sendq.write(data)
+
+    def stream(self, producer):
+        """
+        Sends a long reply through producer (see system.lineproducer), a chunk at a time,
+        after whatever is queued already. It takes the place of any long reply that was still going.
+
+        :type producer: LineProducer
+        """
+
+        if self._sendq is not None:
+            self._sendq.attach(producer)
+
+    def flush(self):
+        """
+        Writes everything that's queued for this client right away.
+        """
+
+        self._sendq.flush()
+
+    def keepalive(self):
+        """
+        Called by the factory's timer wheel. Drops clients that haven't registered by now,
+        PINGs ones that have been quiet for the factory's pinginterval, and drops ones that didn't answer
+        within its pingtimeout. Everything else gets its timer moved ahead.
+        """
+
+        factory = self.factory
+        if not self._client.registered and factory.registertimeout > 0:
+            logger.info('Dropping "{nick}", registration timed out', nick=self._client.nick)
+            self.evict("Registration timed out")
+            return
+
+        if factory.pinginterval <= 0:
+            return
+
+        idle = factory.reactor.seconds() - self.lastseen
+        if idle < factory.pinginterval:
+            self._pinged = False
+            factory.timers.schedule(self, factory.pinginterval - idle, self.keepalive)
+        elif not self._pinged:
+            self._pinged = True
+            self.send(Protocol.ping())
+            factory.timers.schedule(self, factory.pingtimeout, self.keepalive)
+        else:
+            logger.info('Dropping "{nick}", ping timeout', nick=self._client.nick)
+            self.evict("Ping timeout: {seconds} seconds".format(seconds=int(idle)))
+
+    def sendqexceeded(self):
+        """
+        The client isn't reading what we send. Say goodbye and hang up.
+        """
+
+        logger.warn('Dropping "{nick}", sendq exceeded ({size} bytes)', nick=self._client.nick, size=self._sendq.size)
+        self.evict("SendQ exceeded")
+
+    def floodexceeded(self):
+        """
+        The client keeps sending more than flood control lets through. Say goodbye and hang up.
+        """
+
+        logger.warn('Dropping "{nick}", excess flood ({queued} lines waiting)', nick=self._client.nick,
+                    queued=self._flood.queued)
+        Metrics.TOTALS['flood_disconnects'] += 1
+        self._flood.close()
+        self.evict("Excess Flood")
+
+    def quit(self, reason):
+        """
+        The client is leaving. Whatever's queued for them goes out, then an ERROR to say goodbye, and we hang up.
+        If that can't get through in EVICT_TIMEOUT seconds, we pull the plug.
+        Everyone else sees reason in the client's QUIT, once the connection is gone (see IRCFactory.quit).
+
+        :type reason: str
+        """
+
+        self._quitreason = reason
+        self._sendq.flush()
+        self._sendq.close()
+        self.transport.write(Protocol.encode(Protocol.error('Closing Link: ' + reason)))
+        self.transport.loseConnection()
+        self._evictcall = self.factory.reactor.callLater(self.EVICT_TIMEOUT, self.transport.abortConnection)
+
+    def evict(self, reason):
+        """
+        Throws away whatever we were going to send, tells the client why they're being dropped and hangs up.
+        If even that can't get through in EVICT_TIMEOUT seconds, we pull the plug.
+        Everyone else sees the reason in the client's QUIT.
+
+        :type reason: str
+        """
+
+        self._quitreason = reason
+        self._sendq.close()
+        self.transport.write(Protocol.encode(Protocol.error(reason)))
+        self.transport.loseConnection()
+        self._evictcall = self.factory.reactor.callLater(self.EVICT_TIMEOUT, self.transport.abortConnection)
@@ -0,0 +1,174 @@
+"""
+Every connection has a FloodControl. It's a token bucket that every command a client sends has to pay for
+before it's handled, so one client can't keep the reactor to itself by sending as fast as TCP lets it.
+
+The bucket holds up to burst tokens and gets rate tokens back every second. Commands cost about what they
+cost us: most are one token per target, a few (JOIN, NICK, the ones that list things) cost more,
+PING and PONG are almost free (only almost, or they'd be a way around the bucket), and a PRIVMSG or NOTICE
+to a channel costs an extra token for every FANOUT people it goes out to. A command that costs more than
+the whole bucket can still be sent when the bucket is full, it just takes longer to fill up again after.
+
+When the bucket is empty, lines wait in a queue, in the order they came in, and are handled as tokens come back.
+If a client keeps sending faster than that until the queue is full, it's flooding,
+and the connection is told about it through the excess function.
+"""
+
+from builtins import property
+from collections import deque
+
+
+class FloodControl:
+    """
+    A per-connection token bucket with a queue of lines that are waiting for tokens.
+    handle(message) is called for every line once it's been paid for.
+    """
+
+    COST = 1.0  # what a command costs if it isn't in COSTS, per target
+    COSTS = {'JOIN': 2.0,
+             'NICK': 2.0,
+             'LIST': 5.0,
+             'NAMES': 2.0,
+             'STATS': 2.0,
+             'WHO': 2.0,
+             'WHOIS': 2.0,
+             'PING': 0.1,
+             'PONG': 0.1}
+
+    TARGETED = frozenset(('PRIVMSG', 'NOTICE', 'JOIN', 'PART', 'WHOIS'))  # commands that take a comma separated list
+    FANOUT = 100  # channel members a message can reach per extra token
+
+    def __init__(self, reactor, handle, excess, rate=2.0, burst=20.0, limit=64):
+        """
+        :type reactor: twisted.internet.interfaces.IReactorTime
+        :type handle: function
+        :type excess: function
+        :type rate: float
+        :type burst: float
+        :type limit: int
+        """
+        self._reactor = reactor
+        self._handle = handle
+        self._excess = excess
+        self._rate = rate
+        self._burst = burst
+        self._limit = limit
+
+        self._tokens = burst
+        self._last = reactor.seconds()
+        self._queue = deque()  # (message, cost)
+        self._draincall = None
+        self._closed = False
+
+    @property
+    def queued(self):
+        """
+        How many lines are waiting for tokens.
+
+        :rtype: int
+        """
+        return len(self._queue)
+
+    @staticmethod
+    def cost(message, factory):
+        """
+        What message costs to handle.
+
+        :type message: Message
+        :type factory: IRCFactory
+        :rtype: float
+        """
+        command = message.command
+        cost = FloodControl.COSTS.get(command, FloodControl.COST)
+        if command not in FloodControl.TARGETED or not message.params:
+            return cost
+
+        targets = message.params[0].split(',')
+        cost *= len(targets)
+        if command == 'PRIVMSG' or command == 'NOTICE':
+            channels = factory.channels
+            for target in targets:
+                channel = channels.get(target)
+                if channel is not None:
+                    cost += len(channel.clients) / FloodControl.FANOUT
+        return cost
+
+    def refill(self):
+        """
+        Puts back the tokens that have come back since the last time we looked.
+
+        :rtype: None
+        """
+        now = self._reactor.seconds()
+        tokens = self._tokens + (now - self._last) * self._rate
+        self._tokens = tokens if tokens < self._burst else self._burst
+        self._last = now
+
+    def submit(self, message, cost):
+        """
+        Handles message right away if there are tokens for it and nothing is waiting before it,
+        queues it otherwise. Returns whether it was handled right away.
+        Calls the excess function instead if that would put the queue over its limit.
+
+        :type message: Message
+        :type cost: float
+        :rtype: bool
+        """
+        if self._closed:
+            return False
+
+        if not self._queue:
+            self.refill()
+            if self._tokens >= min(cost, self._burst):
+                self._tokens -= cost
+                self._handle(message)
+                return True
+
+        self._queue.append((message, cost))
+        if len(self._queue) > self._limit:
+            self._excess()
+        elif self._draincall is None:
+            self.schedule()
+        return False
+
+    def schedule(self):
+        """
+        Calls drain once there are enough tokens for the first line in the queue.
+
+        :rtype: None
+        """
+        needed = min(self._queue[0][1], self._burst) - self._tokens
+        self._draincall = self._reactor.callLater(max(needed / self._rate, 0.0), self.drain)
+
+    def drain(self):
+        """
+        Handles as many queued lines as there are tokens for.
+
+        :rtype: None
+        """
+        self._draincall = None
+        self.refill()
+
+        queue = self._queue
+        while queue and not self._closed:
+            message, cost = queue[0]
+            if self._tokens < min(cost, self._burst):
+                break
+            queue.popleft()
+            self._tokens -= cost
+            self._handle(message)
+
+        if queue and not self._closed:
+            self.schedule()
+
+    def close(self):
+        """
+        Throws away whatever's queued, and everything submitted after this.
+
+        :rtype: None
+        """
+        self._closed = True
+        if self._draincall is not None:
+            if self._draincall.active():
+                self._draincall.cancel()
+            self._draincall = None
+        self._queue.clear()
@@ -2,279 +2,665 @@
 Everything is a hook. Everything sent from a client will either be caught
 by a hook and handled, or it's not caught, and ends up in a log somewhere.
 
-Hooks consist of two things. A regex, and a function.
-A regex is a regular string, and may look like this:
-'^USER (?P<user>[^\s]+) (?P<mode>[^\s]+) (?P<junk>[^\s]+) :(?P<name>.*)'
+Hooks consist of two things. A command, and a function.
+They're hooked up in main.addhooks(), and may look like this:
+MessageHandler.addhook('USER', handle_user, minparams=4)
 
 You'll find the function below, it's called handle_user(...).
 
-Every hook function is expected to take four parameters:
-    data: Data is the original string that triggered the hook to begin with.
-    match: This is a dictionary. The regex above would yield the following dict:
-           {'user': 'user@blah.balh',
-            'mode': '+i',
-            'junk': 'some-junk-here',
-            'name': 'some name here'}
+Every hook function is expected to take three parameters:
+    message: This is the parsed line that triggered the hook, a domain.message.Message.
+             'USER qt 0 * :some name here' would give you a message where
+             message.command == 'USER' and
+             message.params == ['qt', '0', '*', 'some name here']
+             The trailing parameter is always last in params, with or without its colon.
     client: This is the client that triggered the hook.
-    channels: This is a list of all the channels on the server.
+    factory: This is the IRCFactory. All the channels and clients on the server are in there.
 
 """
 
-from builtins import set
-from itertools import chain
+import heapq
+import re
 
-from domain.channel import Channel
 from domain.client import Client
+from domain.namelist import NameList
 from domain.protocol import Protocol
+from system.lineproducer import LineProducer
+from system.messagehandler import MessageHandler
+from system.metrics import Metrics
 from util import logger
+from util.casemapping import irclower
+from util.wildcard import compilemask, ismask
 
+CHANNEL_PREFIXES = ('#', '&', '+', '!')
+USERMODES = 'iws'  # the user modes clients can set on themselves
+CHANNEL = re.compile(r'[#&+!][^\x00\x07\r\n ,:]*\Z')  # RFC 2812 channel names, a prefix and then no separators
+NICK = re.compile(r'[A-Za-z\[-`{-}][A-Za-z0-9\[-`{-}-]*\Z')  # RFC 2812 nicks, a letter or special and then some
+LONGREPLY = 256  # replies that can be longer than this many lines are streamed (see system.lineproducer)
 
-def handle_user(data, match, client, channels):
+
+def handle_user(message, client, factory):
     """
     This is a handshake. We'll blatantly disregard the whole pinging thing,
     because I don't really care. Clients still ping the server as it is.
     We'll see how it works out.
+    A client is registered once it has sent both USER and NICK, whichever comes last gets the handshake.
 
-    '^USER (?P<user>[^\s]+) (?P<mode>[^\s]+) (?P<junk>[^\s]+) :(?P<name>.*)'
+    USER <user> <mode> <host> :<name>
 
-    :type data: str
-    :type match: dict
+    :type message: Message
     :type client: Client
-    :type channels: list
+    :type factory: IRCFactory
     """
-    client.name = match['name']
-    client.host = match['host']
+    if client.registered:
+        return [Protocol.alreadyregistered(client)]
+
+    client.user = message.params[0]
+    client.name = message.params[3]
+    client.host = message.params[2]
     logger.info("Set new user's name to '{name}'", name=client.name)
     logger.info("Set new user's host to '{host}'", host=client.host)
 
-    response = Protocol.handshake(client)
+    if factory.findclient(client.nick) is client:
+        return _register(client, factory)
 
-    return [line.format(nick=client.nick) for line in response]
 
-
-def handle_nick(data, match, client, channels):
+def handle_nick(message, client, factory):
     """
     When a user changes their nick, tell everyone in all the channels they're in
-    about it.
+    about it. Unless it isn't a nick (see NICK and Protocol.NICKLEN), or someone else has it already,
+    or it looks like someone's uid, then they can't have it.
 
-    '^NICK (?P<nick>.*)'
+    NICK <nick>
 
-    :type data: str
-    :type match: dict
+    :type message: Message
     :type client: Client
-    :type channels: list
+    :type factory: IRCFactory
     """
 
-    newnick = match['nick']
+    newnick = message.params[0]
+
+    if len(newnick) > Protocol.NICKLEN or not NICK.match(newnick):
+        return [Protocol.erroneusnickname(client, _shown(newnick))]
+
+    if factory.isuid(newnick):
+        return [Protocol.erroneusnickname(client, newnick)]
+
+    if not factory.setnick(client, newnick):
+        return [Protocol.nicknameinuse(client, newnick)]
 
     logger.info("Set new user's nick to '{newnick}'", newnick=newnick)
 
-    client.send(Protocol.Nick.response(client.nick, newnick))
+    factory.rename(client, newnick)
+
+    if not client.registered and client.user is not None:
+        return _register(client, factory)
+
+
+def _shown(param):
+    """
+    What to call something a client sent that was no good when we tell them so.
+    Whatever they sent may not fit in a line as a parameter, and then it's '*'.
+
+    :type param: str
+    :rtype: str
+    """
+    return param if param[:1] not in ('', ':') and ' ' not in param else '*'
+
 
-    announce = Protocol.Nick.announce(client, newnick)
-    for cl in set(chain.from_iterable(chan.clients for chan in client.channels)):
-        if cl is not client:
-            cl.send(announce)
+def _register(client, factory):
+    """
+    Tells the factory (and through it, the network) about a client that's done registering, and greets them.
 
-    client.nick = newnick
+    :type client: Client
+    :type factory: IRCFactory
+    :rtype: [str, ...]
+    """
+    factory.register(client)
+    return Protocol.handshake(client)
 
 
-def handle_ping(data, match, client, channels):
+def handle_ping(message, client, factory):
     """
     Ping! Send pong back.
 
-    '^PING.*'
+    PING <token>
 
-    :type data: str
-    :type match: dict
+    :type message: Message
     :type client: Client
-    :type channels: list
+    :type factory: IRCFactory
     """
     # logger.debug("Got ping from {nick}", nick=client.nick)
     return [Protocol.pong()]
 
 
-def handle_pong(data, match, client, channels):
+def handle_pong(message, client, factory):
     """
-    Pong! This will probably never happen because the server isn't pinging.
+    Pong! The answer to the PING a client gets when it's been quiet for a while (see Connection.keepalive).
+    Anything a client sends tells us it's still there, so there's nothing left to do by the time we get here.
 
-    '^PONG.*'
+    PONG <token>
 
-    :type data: str
-    :type match: dict
+    :type message: Message
     :type client: Client
-    :type channels: list
+    :type factory: IRCFactory
     """
     # logger.debug("Got pong from {nick}", nick=client.nick)
 
 
-def handle_join(data, match, client, channels):
+def handle_quit(message, client, factory):
+    """
+    Someone's leaving us. Their connection says goodbye and hangs up, and once it's gone
+    the factory tells everyone who shared a channel with them, and the network.
+
+    QUIT [<reason>]
+
+    :type message: Message
+    :type client: Client
+    :type factory: IRCFactory
+    """
+
+    client.quit('Quit: ' + message.params[0] if message.params else 'Quit')
+
+
+def handle_join(message, client, factory):
     """
     Someone joined a channel! A few things can happen now.
     Either they joined a channel that doesn't exist, and in that case, we create it and
     set them as the owner.
     If it already exists, let's announce their arrival to the participants.
+    Names that can't be channels (see CHANNEL) don't get created, messages couldn't find them.
+
+    JOIN <channel>{,<channel>}
+
+    :type message: Message
+    :type client: Client
+    :type factory: IRCFactory
+    """
+
+    for channame in message.params[0].split(','):
+        if logger.isenabledfor(logger.DEBUG):
+            logger.debug("{nick} joins channel {channame}", nick=client.nick, channame=channame)
+
+        if not CHANNEL.match(channame):
+            client.send(Protocol.nosuchchannel(client, _shown(channame)))
+            continue
+
+        channel = factory.join(client, channame)
+        if channel is None:
+            continue
+
+        client.send([Protocol.topic(client, channel)] + _names(client, channel))
+
+
+def _names(client, channel):
+    """
+    The lines that tell client who's in channel, as many RPL_NAMREPLY as it takes and RPL_ENDOFNAMES.
+
+    :type client: Client
+    :type channel: Channel
+    :rtype: [str, ...]
+    """
+    return [Protocol.names(client, channel, nicks) for nicks in channel.names(client)] + \
+           [Protocol.endofnames(client, channel.name)]
+
+
+def handle_names(message, client, factory):
+    """
+    Someone wants to know who's in a channel, or a few. Channels that don't exist just get the end of the list.
+    Without a channel, we don't list the whole server, just say that's the end of it.
+
+    NAMES [<channel>{,<channel>}]
+
+    :type message: Message
+    :type client: Client
+    :type factory: IRCFactory
+    """
+
+    if not message.params:
+        client.send(Protocol.endofnames(client, '*'))
+        return
+
+    lines = []
+    for channame in message.params[0].split(','):
+        channel = factory.channels.get(channame)
+        lines += _names(client, channel) if channel is not None else [Protocol.endofnames(client, channame)]
+    client.send(lines)
+
+
+def handle_list(message, client, factory):
+    """
+    Someone wants to know what channels there are. Without parameters, that's all of them.
+    Otherwise they can name channels, give masks like #qt* that channel names have to match,
+    and say how many users a channel should have: >5 is more than five, <50 is fewer than fifty.
+
+    There can be a whole lot of channels, so the reply is streamed (see system.lineproducer), and made
+    as the client reads it. Channels that are created after it starts aren't in it, and ones that
+    are gone by the time we get to them are left out.
 
-    '^JOIN (?P<channels>.*)'
+    LIST [<channel|mask|>users|<users>{,<channel|mask|>users|<users>}]
 
-    :type data: str
-    :type match: dict
+    :type message: Message
     :type client: Client
-    :type channels: list
+    :type factory: IRCFactory
     """
 
-    templates = [":{identity} JOIN {channel}",  # join
-                 ":{server} 332 {nick} {channel} :{topic}",  # topic
-                 ":{server} 353 {nick} = {channel} :{nicks}",  # names in channel
-                 ":{server} 366 {nick} {channel} :End of /NAMES list."]  # end of names
+    names, masks = set(), []
+    least, most = 0, None
+    if message.params:
+        for item in message.params[0].split(','):
+            if item[:1] == '>' and item[1:].isdigit():
+                least = max(least, int(item[1:]) + 1)
+            elif item[:1] == '<' and item[1:].isdigit():
+                most = int(item[1:]) - 1 if most is None else min(most, int(item[1:]) - 1)
+            elif ismask(item):
+                masks.append(compilemask(item))
+            elif item:
+                names.add(item)
+
+    if names and not masks:
+        candidates = [name for name in names if name in factory.channels]  # no need to look through them all
+    else:
+        candidates = list(factory.channels)
+
+    lines = _listlines(client, factory.channels, candidates, names, masks, least, most)
+    if client.stream is not None:
+        client.stream(LineProducer(factory.reactor, lines, client.write))
+    else:
+        client.send([line for line in lines if line is not None])
 
-    for channame in match['channels'].split(','):
-        channame = channame.strip()
-        logger.debug("{nick} joins channel {channame}", nick=client.nick, channame=channame)
 
-        if channame not in channels:
-            channels[channame] = Channel(name=channame, owner=client)
+def _listlines(client, channels, candidates, names, masks, least, most):
+    """
+    The LIST reply, a line at a time, with None for every channel that's left out.
+
+    :type client: Client
+    :type channels: dict
+    :type candidates: [str, ...]
+    :type names: set
+    :type masks: [function, ...]
+    :type least: int
+    :type most: int | None
+    :rtype: iterator
+    """
+    yield Protocol.liststart(client)
 
-        channel = channels[channame]
-        channel.clients.append(client)
-        client.channels.append(channel)
+    for name in candidates:
+        channel = channels.get(name)
+        if channel is None:
+            continue
 
-        nicks = ' '.join(client.nick for client in channel.clients)
-        client.send([template.format(channel=channel.name,
-                                     identity=client.identity,
-                                     nick=client.nick,
-                                     nicks=nicks,
-                                     server="localhost",
-                                     topic=channel.topic)
-                     for template in templates])
+        users = len(channel.clients)
+        if users < least or (most is not None and users > most):
+            yield None
+        elif masks and name not in names and not any(match(irclower(name)) for match in masks):
+            yield None
+        else:
+            yield Protocol.list(client, channel, users)
 
-        announce = Protocol.join(client, channel)
-        channel.send(announce)
+    yield Protocol.listend(client)
 
 
-def handle_part(data, match, client, channels):
+def handle_part(message, client, factory):
     """
     Someone is leaving a channel. Let's tell everyone about it and
     remove them from the channel's user listing (and the channel from the client's).
 
-    '^PART (?P<channel>[^\s]+)( :(?P<message>.*))'
+    PART <channel> [:<message>]
 
-    :type data: str
-    :type match: dict
+    :type message: Message
     :type client: Client
-    :type channels: list
+    :type factory: IRCFactory
     """
 
-    channame = match['channel']
+    channels = factory.channels
+    channame = message.params[0]
 
-    logger.debug("{nick} leaves channel {channame}", nick=client.nick, channame=channame)
+    if logger.isenabledfor(logger.DEBUG):
+        logger.debug("{nick} leaves channel {channame}", nick=client.nick, channame=channame)
 
     if not channame in channels:
-        logger.warn("no channel named {channame}", channame=channame)
-        return
+        return [Protocol.nosuchchannel(client, channame)]
 
     channel = channels[channame]
 
-    client.channels.remove(channel)
-    channels[channame].clients.remove(client)
+    if client not in channel.clients:
+        return [Protocol.notonchannel(client, channame)]
+
+    reason = message.params[1] if len(message.params) > 1 else 'leaving'
+    factory.part(client, channel, reason)
+
+
+def handle_privmsg(message, client, factory):
+    """
+    This happens when someone sends something. The target can be a channel, a nick,
+    or a comma separated list of both. Channels get it relayed to everyone in them,
+    nicks get it directly.
+
+    PRIVMSG <target>{,<target>} :<message>
 
-    announce = Protocol.part(client, channel, match['message'] or 'leaving')
-    channel.send(announce)
+    :type message: Message
+    :type client: Client
+    :type factory: IRCFactory
+    """
+
+    targets, text = message.params[0], message.params[1]
+    if logger.isenabledfor(logger.DEBUG):
+        logger.debug('{nick} says "{text}" to {targets}', nick=client.nick, text=text, targets=targets)
+
+    missing = _deliver(Protocol.privmsg, Protocol.Link.privmsg, targets, text, client, factory)
+    if missing:
+        return [Protocol.nosuchnick(client, target) for target in missing]
 
 
-def handle_privmsg(data, match, client, channels):
+def handle_notice(message, client, factory):
     """
-    This happens when someone sends something. If the targeted channel exists,
-    send it to everyone in it.
+    Just like a PRIVMSG, except nobody ever answers a NOTICE automatically.
+    Not even us, so there's no complaining about targets that don't exist.
 
-    TODO: Users can be privmsg'd too, so we should be able to handle that.
+    NOTICE <target>{,<target>} :<message>
+
+    :type message: Message
+    :type client: Client
+    :type factory: IRCFactory
+    """
 
-    '^PRIVMSG (?P<channel>[^\s]+) :(?P<message>.*)'
+    targets, text = message.params[0], message.params[1]
+    if logger.isenabledfor(logger.DEBUG):
+        logger.debug('{nick} notices "{text}" to {targets}', nick=client.nick, text=text, targets=targets)
 
-    :type data: str
-    :type match: dict
+    _deliver(Protocol.notice, Protocol.Link.notice, targets, text, client, factory)
+
+
+def _deliver(template, linktemplate, targets, text, client, factory):
+    """
+    Sends text to every channel and nick in targets, as formatted by template (Protocol.privmsg or Protocol.notice).
+    Each target is found with a dict lookup, and its line is encoded once no matter how many people get it.
+    Channel messages are propagated to linked servers as formatted by linktemplate, and messages for a user
+    on another server go down the link they're behind.
+    Returns the targets that don't exist.
+
+    :type template: function
+    :type linktemplate: function
+    :type targets: str
+    :type text: str
     :type client: Client
-    :type channels: list
+    :type factory: IRCFactory
+    :rtype: [str, ...]
     """
 
-    logger.debug('{nick} says "{message}" to {channel}', nick=client.nick, **match)
-    channame = match['channel']
+    missing = []
+
+    for target in targets.split(','):
+        if target.startswith(CHANNEL_PREFIXES):
+            channel = factory.channels.get(target)
+            if channel is None:
+                missing.append(target)
+            else:
+                channel.relay(client, Protocol.encode(template(client, channel.name, text)))
+                if factory.links:
+                    factory.propagate(linktemplate(client, channel.name, text), exclude=client.link)
+        else:
+            recipient = factory.findclient(target)
+            if recipient is None:
+                missing.append(target)
+            elif recipient.link is not None:
+                recipient.link.write(Protocol.encode(linktemplate(client, recipient.uid, text)))
+            else:
+                recipient.write(Protocol.encode(template(client, recipient.nick, text)))
+
+    return missing
+
+
+def handle_mode(message, client, factory):
+    """
+    Someone is looking at or changing their user modes, like +i to be invisible (see handle_who).
+    Only their own, and only the ones in USERMODES. Channel modes aren't a thing here yet, so those are ignored.
 
-    if channame in channels:
-        channels[channame].say(client, match['message'])
-    else:
-        logger.warn('channel {channame} does not exist', channame=channame)
+    MODE <nick> [{+|-}<modes>{{+|-}<modes>}]
+
+    :type message: Message
+    :type client: Client
+    :type factory: IRCFactory
+    """
 
+    target = message.params[0]
+    if target.startswith(CHANNEL_PREFIXES):
+        return
+    if irclower(target) != irclower(client.nick):
+        return [Protocol.usersdontmatch(client)]
+    if len(message.params) < 2:
+        return [Protocol.umodeis(client)]
+
+    modes, added, removed, unknown = client.mode, '', '', False
+    adding = True
+    for char in message.params[1]:
+        if char in '+-':
+            adding = char == '+'
+        elif char not in USERMODES:
+            unknown = True
+        elif adding and char not in modes:
+            modes += char
+            added += char
+        elif not adding and char in modes:
+            modes = modes.replace(char, '')
+            removed += char
+
+    if logger.isenabledfor(logger.DEBUG):
+        logger.debug("{nick}'s modes are now +{modes}", nick=client.nick, modes=modes)
+    client.mode = modes
+
+    response = [Protocol.umodeunknownflag(client)] if unknown else []
+    if added or removed:
+        response.append(Protocol.usermode(client, ('+' + added if added else '') + ('-' + removed if removed else '')))
+    return response
+
+
+def handle_stats(message, client, factory):
+    """
+    Someone wants numbers. We have numbers!
+    m: how many times each command has been used
+    u: how long the server has been up
+    l: traffic for their own connection (everyone else's is none of their business)
+    z: how many clients and channels there are, and the biggest channels
+    p: how long each hook has taken, if hook profiling is on (see MessageHandler.setprofiling)
 
-def handle_mode(data, match, client, channels):
+    STATS [<query>]
+
+    :type message: Message
+    :type client: Client
+    :type factory: IRCFactory
     """
-    Someone is setting their mode. I don't know enough about this to talk about it yet.
 
-    '^MODE (?P<nick>[^\s]+) (?P<mode>.*)'
+    query = message.params[0][:1] if message.params else ''
+    response = []
+
+    if query == 'm':
+        for command, histogram in sorted(Metrics.COMMANDS.items()):
+            response.append(Protocol.statscommands(client, command, histogram.count))
+
+    elif query == 'u':
+        response.append(Protocol.statsuptime(client, Metrics.uptime()))
+
+    elif query == 'l':
+        now = factory.reactor.seconds()
+        for connection in factory.clients:
+            if connection.client is client:
+                response.append(Protocol.statslinkinfo(client, client.nick, connection.sendqsize,
+                                                       connection.writes, connection.bytesout,
+                                                       connection.linesin, connection.bytesin,
+                                                       now - connection.since))
+                break
+
+    elif query == 'z':
+        response.append(Protocol.statsdebug(client, '{clients} clients, {channels} channels'.format(
+            clients=len(factory.clients), channels=len(factory.channels))))
+        biggest = heapq.nlargest(Metrics.TOPCHANNELS, factory.channels.values(),
+                                 key=lambda channel: len(channel.clients))
+        for channel in biggest:
+            response.append(Protocol.statsdebug(client, '{name} {count}'.format(name=channel.name,
+                                                                              count=len(channel.clients))))
+
+    elif query == 'p':
+        response.append(Protocol.statsdebug(client, 'Hook profiling is {state}, slow is {slow} ms'.format(
+            state='on' if MessageHandler.PROFILING else 'off', slow=MessageHandler.SLOW * 1000)))
+        profiles = sorted(MessageHandler.PROFILE.items(), key=lambda item: item[1].total, reverse=True)
+        for name, profile in profiles:
+            response.append(Protocol.statsdebug(client, '{name} calls={calls} total={total:.1f}ms '
+                                                        'mean={mean:.3f}ms worst={worst:.3f}ms'.format(
+                name=name, calls=profile.calls, total=profile.total * 1000,
+                mean=profile.total * 1000 / profile.calls, worst=profile.worst * 1000)))
+
+    response.append(Protocol.endofstats(client, query or '*'))
+    return response
+
+
+def handle_whois(message, client, factory):
+    """
+    Someone is asking who someone is, or a few someones. Let's tell them what we know!
+    Everything we know about a user is known on every server, so if they ask a particular one, we answer anyway.
+    We don't keep idle times or away messages yet, so those are left out.
 
-    :type data: str
-    :type match: dict
+    WHOIS [<server>] <nick>{,<nick>}
+
+    :type message: Message
     :type client: Client
-    :type channels: list
+    :type factory: IRCFactory
     """
 
-    logger.debug("setting {nick}'s mode to {mode}, as per their request", **match)
-    client.mode = match['mode'].replace('+', '')
+    response = []
+    for nick in message.params[-1].split(','):
+        target = factory.findclient(nick)
+        if target is None or not target.registered:
+            response.append(Protocol.nosuchnick(client, nick))
+            response.append(Protocol.Whois.endofwhois(client, nick))
+            continue
+
+        response.append(Protocol.Whois.whoisuser(client, target))
+        if target.channels:
+            channels = NameList(Protocol.Whois.channelsroom(client, target))
+            for channel in target.channels:
+                channels.add(channel, channel.clients.get(target, '') + channel.name)
+            response += [Protocol.Whois.whoischannels(client, target, chunk) for chunk in channels.chunks()]
+        response.append(Protocol.Whois.whoisserver(client, target, factory.servername(target)))
+        response.append(Protocol.Whois.endofwhois(client, target.nick))
+
+    return response
 
 
-def handle_whois(data, match, client, channels):
+def handle_who(message, client, factory):
     """
-    Someone is asking who someone is. Let's tell them what we know!
-    TODO: All of it.
+    Someone wants to know who's in a channel, or whose nick or host matches a mask.
+    Bots do this every time they join a channel, so it has to be cheap: a channel's members are right there,
+    and a mask without wildcards is looked up in the nick and host indexes. Only a mask with wildcards
+    means going through every nick and host, and that reply is streamed (see system.lineproducer),
+    like a channel's is when it's a big one. Nicks, hosts and masks are all up to users, which is why
+    masks are matched by util.wildcard, where no mask can take more than a moment.
 
-    '^WHOIS (?P<nick>[^\s]+)'
+    Invisible users (+i) only show up for people who share a channel with them.
+    There are no IRC operators yet, so asking for operators only (the o flag) finds nobody.
 
-    :type data: str
-    :type match: dict
+    WHO [<channel|mask> [o]]
+
+    :type message: Message
     :type client: Client
-    :type channels: list
+    :type factory: IRCFactory
     """
 
-    response = [Protocol.Whois.whoisuser(),
-                Protocol.Whois.whoischannels(),
-                Protocol.Whois.whoisserver(),
-                Protocol.Whois.endofwhois()]
+    mask = message.params[0] if message.params else '*'
+    if len(message.params) > 1 and 'o' in message.params[1]:
+        return [Protocol.endofwho(client, mask)]
+
+    if mask[:1] in CHANNEL_PREFIXES:
+        channel = factory.channels.get(mask)
+        if channel is None:
+            return [Protocol.endofwho(client, mask)]
+        members = list(channel.clients.items())
+        lines = _wholines(client, factory, channel.name, members, mask)
+        streamed = len(members) > LONGREPLY
+    else:
+        lines = _wholines(client, factory, '*', _whomatches(mask, factory), mask)
+        streamed = ismask(mask) or mask == '0'
+
+    if streamed and client.stream is not None:
+        client.stream(LineProducer(factory.reactor, lines, client.write))
+    else:
+        client.send([line for line in lines if line is not None])
+
 
+def _whomatches(mask, factory):
     """
-    3.6.2 Whois query
+    Everyone whose nick or host matches mask, as (client, '') pairs, with None for every nick or host
+    that's looked at and doesn't match. 0 and * are everyone.
 
-          Command: WHOIS
-       Parameters: [ <target> ] <mask> *( "," <mask> )
+    :type mask: str
+    :type factory: IRCFactory
+    :rtype: iterator
+    """
+    if mask == '0' or mask == '*':
+        for member in list(factory.uids.values()):
+            yield member, ''
+        return
 
-       This command is used to query information about particular user.
-       The server will answer this command with several numeric messages
-       indicating different statuses of each user which matches the mask (if
-       you are entitled to see them).  If no wildcard is present in the
-       <mask>, any information about that nick which you are allowed to see
-       is presented.
+    if not ismask(mask):
+        found = factory.findclient(mask)
+        if found is not None and found.registered:
+            yield found, ''
+        for member in list(factory.hosts.get(irclower(mask), ())):
+            if member is not found:
+                yield member, ''
+        return
 
-       If the <target> parameter is specified, it sends the query to a
-       specific server.  It is useful if you want to know how long the user
-       in question has been idle as only local server (i.e., the server the
-       user is directly connected to) knows that information, while
-       everything else is globally known.
+    match = compilemask(mask)
+    for nick, member in list(factory.nicks.items()):
+        yield (member, '') if member.registered and match(nick) else None
+    for host, members in list(factory.hosts.items()):
+        if not match(host):
+            yield None
+            continue
+        for member in list(members):
+            if not match(irclower(member.nick)):  # the ones whose nick matched are in already
+                yield member, ''
 
-       Wildcards are allowed in the <target> parameter.
 
-       Numeric Replies:
+def _wholines(client, factory, channame, members, mask):
+    """
+    The WHO reply, a line at a time. members are (client, prefix) pairs, and None for everyone who's
+    left out gives None (see system.lineproducer). So do people who are gone by the time we get to them.
 
-               ERR_NOSUCHSERVER              ERR_NONICKNAMEGIVEN
-               RPL_WHOISUSER                 RPL_WHOISCHANNELS
-               RPL_WHOISCHANNELS             RPL_WHOISSERVER
-               RPL_AWAY                      RPL_WHOISOPERATOR
-               RPL_WHOISIDLE                 ERR_NOSUCHNICK
-               RPL_ENDOFWHOIS
+    :type client: Client
+    :type factory: IRCFactory
+    :type channame: str
+    :type members: iterable
+    :type mask: str
+    :rtype: iterator
+    """
+    uids = factory.uids
+    for pair in members:
+        if pair is None:
+            yield None
+            continue
+
+        member, prefix = pair
+        if uids.get(member.uid) is not member or not _cansee(client, member):
+            yield None
+            continue
+        yield Protocol.who(client, channame, member, factory.servername(member), 'H' + prefix,
+                           0 if member.link is None else 1)
+
+    yield Protocol.endofwho(client, mask)
 
-       Examples:
 
-       WHOIS wiz                       ; return available user information
-                                       about nick WiZ
+def _cansee(client, member):
+    """
+    Tells you if client gets to see member in a WHO reply: they do unless member is invisible,
+    and even then if they share a channel.
 
-       WHOIS eff.org trillian          ; ask server eff.org for user
-                                       information  about trillian
-    """
\ No newline at end of file
+    :type client: Client
+    :type member: Client
+    :rtype: bool
+    """
+    if 'i' not in member.mode or member is client:
+        return True
+    channels = member.channels
+    return any(channel in channels for channel in client.channels)
@@ -1,18 +1,101 @@
-from builtins import super, property, dict
+from builtins import super, property, dict, set
 from collections import deque
+import itertools
 from twisted.internet.protocol import ServerFactory
 
+from domain.channel import Channel
+from domain.protocol import Protocol
+from system.metrics import Metrics
+from util.casemapping import irclower
+from util.memberset import MemberSet
+from util.timerwheel import TimerWheel
+
 
 class IRCFactory(ServerFactory):
     """
     This is where networking is born! It's also where we list all our clients and channels.
     When a user connects, a ClientConnection is born to cater to them.
+    Clients are also indexed by nick (RFC 1459 casemapped), so finding one never means looking through all of them,
+    and once they've registered, by host as well.
+
+    It also holds the knobs every connection shares:
+    flushdelay is how long (in seconds) a connection may hold on to outgoing lines before writing them,
+    0 meaning "at the end of this reactor tick". flushsize is how many buffered bytes make it write right away.
+    maxsendq is how many bytes may queue up for a client that isn't reading before it gets disconnected.
+    maxline is the longest line (with its CRLF) a client may send us, and maxtags how long the IRCv3 tags
+    in front of it may be on top of that. Longer lines get ERR_INPUTTOOLONG (see util.linebuffer).
+    floodrate is how many tokens a second a client's flood control bucket fills up with (0 turns it off),
+    floodburst how many it holds, and floodqueue how many lines may wait for tokens before the client
+    is dropped for flooding (see system.floodcontrol).
+    Clients that haven't registered registertimeout seconds after connecting are dropped. Registered ones
+    get a PING after pinginterval quiet seconds, and are dropped if they don't answer within pingtimeout.
+    These timers are all on one TimerWheel, timers (see util.timerwheel). A timeout of 0 turns it off.
+
+    A channel is forgotten as soon as the last person in it leaves, so a server that's been up for weeks
+    doesn't hold on to every channel anyone ever joined. The ones named in keepchannels are the exception:
+    they're there from the start, and stay (topic and all) whether anyone's in them or not.
+
+    The factory can be linked to other servers (see system.link), which is how several worker processes
+    or several machines share users and channels. Everything that changes who's where (register, rename,
+    join, part, quit) goes through the methods down below, which tell our own users about it and
+    propagate it to every link but the one it came from. Without links, that last part costs nothing.
+    sid is this server's id on the network, three characters starting with a letter,
+    and name is what other servers call it, and what our numerics say they come from (see Protocol.setserver).
     """
 
-    def __init__(self, *args, **kw):
-        super(*args, **kw)
+    def __init__(self, reactor=None, flushdelay=0.0, flushsize=16384, maxsendq=1048576, sid='K00', name=None,
+                 maxline=512, maxtags=8191, floodrate=2.0, floodburst=20.0, floodqueue=64,
+                 registertimeout=60.0, pinginterval=120.0, pingtimeout=60.0, keepchannels=()):
+        """
+        :type reactor: twisted.internet.interfaces.IReactorTime
+        :type flushdelay: float
+        :type flushsize: int
+        :type maxsendq: int
+        :type sid: str
+        :type name: str
+        :type maxline: int
+        :type maxtags: int
+        :type floodrate: float
+        :type floodburst: float
+        :type floodqueue: int
+        :type registertimeout: float
+        :type pinginterval: float
+        :type pingtimeout: float
+        :type keepchannels: (str, ...)
+        """
+        super().__init__()
+
+        if reactor is None:
+            from twisted.internet import reactor
+
+        self.reactor = reactor
+        self.sid = sid
+        self.name = name or Protocol.SERVER
+        Protocol.setserver(self.name)  # before there are any channels, they size their NAMES replies with it
+        self.flushdelay = flushdelay
+        self.flushsize = flushsize
+        self.maxsendq = maxsendq
+        self.maxline = maxline
+        self.maxtags = maxtags
+        self.floodrate = floodrate
+        self.floodburst = floodburst
+        self.floodqueue = floodqueue
+        self.registertimeout = registertimeout
+        self.pinginterval = pinginterval
+        self.pingtimeout = pingtimeout
+        self.timers = TimerWheel(reactor)
+
         self._clients = deque()
         self._channels = dict()
+        self._nicks = dict()  # irclower(nick) -> Client
+        self._hosts = dict()  # irclower(host) -> MemberSet of registered Clients
+        self.keepchannels = frozenset(keepchannels)
+        for channame in self.keepchannels:
+            self._channels[channame] = Channel(name=channame, owner=None)
+
+        self._uids = dict()  # uid -> Client, for everyone registered, here or elsewhere
+        self._links = []
+        self._uidcount = itertools.count(1)
 
     @property
     def clients(self):
@@ -34,3 +117,327 @@ class IRCFactory(ServerFactory):
         :rtype : dict
         """
         return self._channels
+
+    @property
+    def nicks(self):
+        """
+        Every client that has picked a nick, keyed by irclower(nick).
+
+        :rtype : dict
+        """
+        return self._nicks
+
+    @property
+    def hosts(self):
+        """
+        Every registered client on the network, grouped by irclower(host).
+
+        :rtype : dict
+        """
+        return self._hosts
+
+    @property
+    def uids(self):
+        """
+        Every registered client on the network, keyed by uid.
+
+        :rtype : dict
+        """
+        return self._uids
+
+    @property
+    def links(self):
+        """
+        The Links to other servers.
+
+        :rtype : list
+        """
+        return self._links
+
+    def nextuid(self):
+        """
+        A new uid for one of our clients: our sid and six more letters and digits.
+        Uids are valid nicks, so a client that loses a nick collision can be renamed to theirs.
+
+        :rtype: str
+        """
+        number = next(self._uidcount)
+        digits = []
+        for _ in range(6):
+            number, digit = divmod(number, 36)
+            digits.append('0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'[digit])
+        return self.sid + ''.join(reversed(digits))
+
+    def isuid(self, nick):
+        """
+        Whether nick looks like the uid of someone on a server we know of: its sid and six more letters and digits.
+        Those are kept free for nick collisions, so users can't have them.
+
+        :type nick: str
+        :rtype: bool
+        """
+        if len(nick) != 9 or not nick.isascii() or not nick.isalnum():
+            return False
+        sid = nick[:3].upper()
+        return sid == self.sid or any(sid in link.servers for link in self._links)
+
+    def findclient(self, nick):
+        """
+        Returns the client using a nick, or None if nobody is.
+
+        :type nick: str
+        :rtype: Client | None
+        """
+        return self._nicks.get(irclower(nick))
+
+    def setnick(self, client, nick):
+        """
+        Claims a nick for a client, and lets go of the one it had. This doesn't change client.nick, do that after.
+        Returns False, without changing anything, if someone else already has the nick.
+
+        :type client: Client
+        :type nick: str
+        :rtype: bool
+        """
+        key = irclower(nick)
+        owner = self._nicks.get(key)
+        if owner is not None and owner is not client:
+            return False
+
+        self.removenick(client)
+        self._nicks[key] = client
+        return True
+
+    def removenick(self, client):
+        """
+        Lets go of the nick a client is using, if it's theirs.
+
+        :type client: Client
+        :rtype: None
+        """
+        key = irclower(client.nick)
+        if self._nicks.get(key) is client:
+            del self._nicks[key]
+
+    def addhost(self, client):
+        """
+        Files a client under their host. Hosts don't change once a client has registered.
+
+        :type client: Client
+        :rtype: None
+        """
+        key = irclower(client.host)
+        clients = self._hosts.get(key)
+        if clients is None:
+            clients = self._hosts[key] = MemberSet()
+        clients.add(client)
+
+    def removehost(self, client):
+        """
+        Takes a client out of the host index, and forgets the host if they were the last one on it.
+
+        :type client: Client
+        :rtype: None
+        """
+        key = irclower(client.host)
+        clients = self._hosts.get(key)
+        if clients is not None and clients.discard(client) and not clients:
+            del self._hosts[key]
+
+    def servername(self, client):
+        """
+        The name of the server client is on. Servers we haven't been told the name of go by their sid.
+
+        :type client: Client
+        :rtype: str
+        """
+        if client.link is None:
+            return self.name
+        sid = client.uid[:3]
+        return client.link.servers.get(sid, sid)
+
+    def propagate(self, line, exclude=None):
+        """
+        Sends a link line to every link except exclude, usually the one it came from.
+
+        :type line: str
+        :type exclude: Link
+        :rtype: None
+        """
+        if not self._links:
+            return
+
+        data = Protocol.encode(line)
+        for link in self._links:
+            if link is not exclude:
+                link.write(data)
+
+    def register(self, client):
+        """
+        A client of ours has sent both NICK and USER. From now on the rest of the network knows about them.
+
+        :type client: Client
+        :rtype: None
+        """
+        client.registered = True
+        self._uids[client.uid] = client
+        self.addhost(client)
+        self.propagate(Protocol.Link.uid(self.sid, client))
+
+    def introduce(self, client):
+        """
+        A user on another server, that's already been given a nick nobody here has (see resolvenick).
+
+        :type client: Client
+        :rtype: None
+        """
+        self._uids[client.uid] = client
+        self._nicks[irclower(client.nick)] = client
+        self.addhost(client)
+        self.propagate(Protocol.Link.uid(client.uid[:3], client), exclude=client.link)
+
+    def resolvenick(self, client, nick, ts):
+        """
+        Sorts out a nick collision between a user on another server wanting nick (taken at ts) and whoever has it here.
+        The one who took it first keeps it, and if that was at the same second, the lower uid does.
+        The other one is renamed to their uid, on every server, without anyone having to tell anyone.
+        Returns the nick the remote client ends up with.
+
+        :type client: Client
+        :type nick: str
+        :type ts: int
+        :rtype: str
+        """
+        holder = self.findclient(nick)
+        if holder is None or holder is client:
+            return nick
+
+        if (holder.ts, holder.uid) < (ts, client.uid):
+            self._freeuid(client)
+            return client.uid
+
+        self._freeuid(holder)
+        self.rename(holder, holder.uid, holder.ts, propagate=holder.link is None)
+        return nick
+
+    def _freeuid(self, client):
+        """
+        Makes sure nobody else is using client's uid as a nick, so client can be renamed to it.
+        Local users can't take one, but a server that linked later may have a user who already had it,
+        and they're renamed to their own uid in turn.
+
+        :type client: Client
+        """
+        squatter = self.findclient(client.uid)
+        if squatter is None or squatter is client:
+            return
+
+        self._freeuid(squatter)
+        self.rename(squatter, squatter.uid, squatter.ts, propagate=squatter.link is None)
+
+    def rename(self, client, nick, ts=None, propagate=True):
+        """
+        Gives client a nick and tells them, and everyone who shares a channel with them. The nick has to be free,
+        or theirs already. ts defaults to now.
+
+        :type client: Client
+        :type nick: str
+        :type ts: int
+        :type propagate: bool
+        :rtype: None
+        """
+        self.removenick(client)
+        self._nicks[irclower(nick)] = client
+
+        client.send(Protocol.Nick.response(client.nick, nick))
+        announce = Protocol.encode(Protocol.Nick.announce(client, nick))
+        recipients = set()
+        for channel in client.channels:
+            recipients.update(channel.clients)
+        recipients.discard(client)
+        for cl in recipients:
+            cl.write(announce)
+
+        client.nick = nick
+        client.ts = int(self.reactor.seconds()) if ts is None else ts
+        for channel in client.channels:
+            channel.renamed(client)
+
+        if propagate and client.registered:
+            self.propagate(Protocol.Link.nick(client, nick), exclude=client.link)
+
+    def join(self, client, channame):
+        """
+        Puts client in a channel, creating it if it has to, and tells everyone in there.
+        Returns the channel, or None if they were in it already.
+
+        :type client: Client
+        :type channame: str
+        :rtype: Channel | None
+        """
+        channel = self._channels.get(channame)
+        if channel is None:
+            channel = self._channels[channame] = Channel(name=channame, owner=client)
+
+        if not channel.add(client):
+            return None
+        client.channels.add(channel)
+
+        channel.send(Protocol.join(client, channel))
+        if self._links:
+            self.propagate(Protocol.Link.join(client, channel), exclude=client.link)
+        return channel
+
+    def part(self, client, channel, reason):
+        """
+        Takes client out of a channel, after telling everyone in there (them too).
+
+        :type client: Client
+        :type channel: Channel
+        :type reason: str
+        :rtype: None
+        """
+        channel.send(Protocol.part(client, channel, reason))
+        channel.discard(client)
+        client.channels.discard(channel)
+        self.reclaim(channel)
+
+        if self._links:
+            self.propagate(Protocol.Link.part(client, channel, reason), exclude=client.link)
+
+    def quit(self, client, reason):
+        """
+        Client is gone. Everyone who shared a channel with them hears about it once, however many channels that was.
+
+        :type client: Client
+        :type reason: str
+        :rtype: None
+        """
+        announce = Protocol.encode(Protocol.quit(client, reason))
+        recipients = set()
+        for channel in client.channels:
+            channel.discard(client)
+            recipients.update(channel.clients)
+        for cl in recipients:
+            cl.write(announce)
+        for channel in client.channels:
+            self.reclaim(channel)
+
+        self.removenick(client)
+        if client.registered:
+            self._uids.pop(client.uid, None)
+            self.removehost(client)
+            self.propagate(Protocol.Link.quit(client, reason), exclude=client.link)
+
+    def reclaim(self, channel):
+        """
+        Forgets channel if nobody's in it anymore, unless it's one we keep.
+
+        :type channel: Channel
+        :rtype: None
+        """
+        if channel.clients or channel.name in self.keepchannels:
+            return
+        if self._channels.get(channel.name) is channel:
+            del self._channels[channel.name]
+            Metrics.TOTALS['channels_reclaimed'] += 1
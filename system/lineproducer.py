@@ -0,0 +1,89 @@
+"""
+Some replies are long. LIST over every channel on a big server is hundreds of thousands of lines, and building
+that in one go would hold up the reactor for as long as it takes, and keep the whole reply in memory
+until the client got around to reading it.
+
+A LineProducer writes a reply a chunk at a time instead, one chunk per reactor turn, pulling the lines out of
+an iterator as it goes. It's a streaming producer behind the connection's SendQueue (see SendQueue.attach):
+when the client stops reading, the transport pauses the sendq, the sendq pauses us, and no more lines
+are made until the client has caught up.
+
+The iterator can give None instead of a line. That's nothing to send, but it counts towards the chunk,
+so going through lots of things that don't end up in the reply gives the reactor back now and then too.
+"""
+
+from builtins import len
+import itertools
+
+from twisted.internet.interfaces import IPushProducer
+from zope.interface import implementer
+
+from domain.protocol import Protocol
+
+
+@implementer(IPushProducer)
+class LineProducer:
+    """
+    Writes the lines from an iterator with write(data), chunk of them per reactor turn, until it runs out.
+    It starts out paused, attaching it to a SendQueue is what starts it.
+    """
+
+    def __init__(self, reactor, lines, write, chunk=256):
+        """
+        :type reactor: twisted.internet.interfaces.IReactorTime
+        :type lines: iterable
+        :type write: function
+        :type chunk: int
+        """
+        self._reactor = reactor
+        self._lines = iter(lines)
+        self._write = write
+        self._chunk = chunk
+
+        self._producecall = None
+        self._paused = True
+        self._finished = False
+
+    @property
+    def finished(self):
+        """
+        True once every line has been written, or we were stopped.
+
+        :rtype: bool
+        """
+        return self._finished
+
+    def produce(self):
+        """
+        Writes the next chunk of lines.
+
+        :rtype: None
+        """
+        self._producecall = None
+
+        lines = list(itertools.islice(self._lines, self._chunk))
+        if len(lines) < self._chunk:
+            self._finished = True
+
+        data = [Protocol.encode(line) for line in lines if line is not None]
+        if data:
+            self._write(b''.join(data))  # this can pause or stop us
+
+        if not self._finished and not self._paused:
+            self._producecall = self._reactor.callLater(0, self.produce)
+
+    def pauseProducing(self):
+        self._paused = True
+        if self._producecall is not None:
+            if self._producecall.active():
+                self._producecall.cancel()
+            self._producecall = None
+
+    def resumeProducing(self):
+        self._paused = False
+        if not self._finished and self._producecall is None:
+            self._producecall = self._reactor.callLater(0, self.produce)
+
+    def stopProducing(self):
+        self.pauseProducing()
+        self._finished = True
@@ -0,0 +1,432 @@
+"""
+A Link is a connection to another server. Worker processes use one to talk to each other through the bus
+(see system.bus), and whole servers use them over TCP to form a network, linked up like a tree:
+there must only ever be one way to get from one server to another, so a server that shows up twice
+(someone linked a loop) gets its newest link dropped.
+
+The side that connects speaks first: PASS <password> if it was given one, and SERVER. The side that accepted
+says nothing until it's heard the right password (it hangs up on anyone who doesn't know it), and only then
+sends its own PASS, and its SERVER once it's heard the other side's. The connecting side checks that PASS
+the same way. A link only becomes one of the factory's links, and hears what's going on, once the other side
+has got through all that, so anything else it says before then is ignored.
+Idle links are pinged, and dropped if they stop answering.
+
+After SERVER, each side tells the other about every user it knows that isn't behind that link
+(the burst): UID for every user, and JOIN for every channel they're in.
+After that, everything that changes who's where is propagated as it happens, by IRCFactory.
+The lines are in Protocol.Link.
+
+Users on the other side get a Client of their own here, with a send and write that do nothing, so
+channels and nick lookups don't need to know the difference. Channel messages cross a link once,
+and the other side fans them out to its own users.
+
+Everything a link hears is applied here and passed on to our other links, never back where it came from.
+Hearing the same thing twice (a user or a JOIN we already know about) does nothing, so it's fine
+for a burst to repeat what's already been propagated.
+"""
+
+from builtins import set, int
+import hmac
+
+from twisted.internet import protocol, task
+from twisted.protocols import basic
+
+from domain.client import Client
+from domain.message import Message
+from domain.protocol import Protocol
+from util import logger
+
+
+def _discard(data):
+    """
+    What a remote user's send and write do. They hear about things from their own server.
+    """
+    pass
+
+
+class Link(basic.LineReceiver):
+    MAX_LENGTH = 65536  # a burst line is small, but there's no reason to be as strict as with clients
+
+    SPLIT = '*.net *.split'  # the quit reason users get when the server they were on is gone
+
+    def __init__(self, ircfactory, password=None, keepalive=0, initiator=False):
+        """
+        password is what both ends have to say before anything else, None for no password.
+        initiator is True for the side that connected, which is the one that speaks first.
+        keepalive is how many idle seconds go by before the other side is pinged, 0 for never.
+        Twice that without hearing anything, and the link is dropped.
+
+        :type ircfactory: IRCFactory
+        :type password: str
+        :type keepalive: float
+        :type initiator: bool
+        """
+        self.ircfactory = ircfactory
+        self.servers = dict()  # sid -> name, for every server behind this link
+        self.password = password
+        self.authenticated = password is None
+        self.initiator = initiator
+        self.registered = False  # True once the other side has said PASS and SERVER, and we're in factory.links
+        self.keepalive = keepalive
+        self.lastheard = None
+        self._pinger = None
+
+    def connectionMade(self):
+        logger.info("Linked to {peer}", peer=self.transport.getPeer())
+        self.lastheard = self.ircfactory.reactor.seconds()
+
+        if self.initiator:
+            if self.password is not None:
+                self.sendLine(('PASS ' + self.password).encode())
+            self.sendLine(Protocol.Link.server(self.ircfactory.sid, self.ircfactory.name).encode())
+
+        if self.keepalive:
+            self._pinger = task.LoopingCall(self.ping)
+            self._pinger.clock = self.ircfactory.reactor
+            self._pinger.start(self.keepalive, now=False)
+
+    # noinspection PyMethodOverriding
+    def connectionLost(self, reason):
+        factory = self.ircfactory
+        logger.warn("Lost link to {servers}", servers=' '.join(sorted(self.servers)) or 'nobody')
+
+        if self._pinger is not None and self._pinger.running:
+            self._pinger.stop()
+
+        if self in factory.links:
+            factory.links.remove(self)
+
+        for client in [client for client in factory.uids.values() if client.link is self]:
+            factory.quit(client, Link.SPLIT)
+
+        for sid in self.servers:
+            factory.propagate(Protocol.Link.squit(factory.sid, sid, Link.SPLIT))
+        self.servers.clear()
+
+    def write(self, data):
+        """
+        :type data: bytes
+        """
+        self.transport.write(data)
+
+    def drop(self, reason):
+        """
+        Says why and hangs up.
+
+        :type reason: str
+        :rtype: None
+        """
+        logger.warn("Dropping link to {peer}: {reason}", peer=self.transport.getPeer(), reason=reason)
+        self.write(Protocol.encode(Protocol.error(reason)))
+        self.transport.loseConnection()
+
+    def ping(self):
+        """
+        Called every keepalive seconds. Pings the other side if it's been quiet, drops it if it's been too quiet.
+        """
+        idle = self.ircfactory.reactor.seconds() - self.lastheard
+        if idle >= 2 * self.keepalive:
+            self.drop('Ping timeout')
+        elif idle >= self.keepalive:
+            self.write(Protocol.encode('PING :' + self.ircfactory.sid))
+
+    def lineReceived(self, data):
+        """
+        :type data: bytes
+        """
+        line = data.decode('utf-8', 'replace')
+        self.lastheard = self.ircfactory.reactor.seconds()
+
+        if logger.isenabledfor(logger.DEBUG):
+            logger.debug('Link got "{line}"', line=line)
+
+        message = Message.parse(line)
+        if message is None:
+            return
+
+        if not self.authenticated:
+            if message.command == 'PASS' and message.params and \
+                    hmac.compare_digest(message.params[0].encode(), self.password.encode()):
+                self.authenticated = True
+                if not self.initiator:
+                    self.sendLine(('PASS ' + self.password).encode())
+            else:
+                self.drop('Bad password')
+            return
+
+        if not self.registered and message.command not in ('PASS', 'SERVER'):
+            # On the bus, other workers can be talking before they've heard about us. Their bursts will catch us up.
+            if logger.isenabledfor(logger.DEBUG):
+                logger.debug('Link ignored "{line}", it hasn\'t said SERVER yet', line=line)
+            return
+
+        handler = Link.HANDLERS.get(message.command)
+        if handler is None:
+            logger.warn('Link got something it doesn\'t understand: "{line}"', line=line)
+            return
+
+        try:
+            handler(self, message, line)
+        except (IndexError, ValueError):
+            logger.warn('Link got a broken line: "{line}"', line=line)
+
+    def burst(self):
+        """
+        Tells the other side about every user we know that isn't behind this link, and every channel they're in.
+
+        :rtype: None
+        """
+        factory = self.ircfactory
+        lines = []
+
+        for client in factory.uids.values():
+            if client.link is not self:
+                lines.append(Protocol.Link.uid(client.uid[:3], client))
+
+        for channel in factory.channels.values():
+            for client in channel.clients:
+                if client.registered and client.link is not self:
+                    lines.append(Protocol.Link.join(client, channel))
+
+        if lines:
+            self.write(b''.join(Protocol.encode(line) for line in lines))
+
+    def remote(self, uid):
+        """
+        The user behind this link with this uid, or None. Things a link says about anyone else are ignored.
+
+        :type uid: str
+        :rtype: Client | None
+        """
+        client = self.ircfactory.uids.get(uid)
+        if client is None or client.link is not self:
+            return None
+        return client
+
+    def handle_server(self, message, line):
+        """
+        SERVER <sid> <name> is the other side saying hello, so it gets a hello and a burst back.
+        With a prefix, it's a server further away being introduced, which just gets passed on.
+        """
+        sid, name = message.params[0], message.params[1]
+        factory = self.ircfactory
+
+        if message.prefix is not None and not self.registered:
+            self.drop('Introduced a server before saying who it is')
+            return
+        if sid in self.servers:
+            return
+        if sid == factory.sid or any(sid in link.servers for link in factory.links):
+            self.drop('Server {sid} already exists'.format(sid=sid))
+            return
+        self.servers[sid] = name
+        logger.info("Server {sid} ({name}) joined the network", sid=sid, name=name)
+
+        if message.prefix is None:
+            if not self.registered:
+                self.registered = True
+                factory.links.append(self)
+            self.sendLine(Protocol.Link.server(factory.sid, factory.name).encode())
+            self.burst()
+
+        factory.propagate(':' + factory.sid + ' ' + Protocol.Link.server(sid, name), exclude=self)
+
+    def handle_pass(self, message, line):
+        """
+        PASS <password> was already checked, if we have a password. If we don't, we don't care.
+        """
+        pass
+
+    def handle_ping(self, message, line):
+        """
+        PING :<token>
+        """
+        self.write(Protocol.encode('PONG :' + (message.params[0] if message.params else '')))
+
+    def handle_pong(self, message, line):
+        """
+        PONG :<token>, all it does is make lastheard recent.
+        """
+        pass
+
+    def handle_error(self, message, line):
+        """
+        ERROR :<reason>, the other side is about to hang up on us.
+        """
+        logger.warn("Link error from {servers}: {reason}", servers=' '.join(sorted(self.servers)) or 'nobody',
+                    reason=message.params[0] if message.params else '')
+
+    def handle_squit(self, message, line):
+        """
+        :<sid> SQUIT <sid> :<reason>, a server is gone, and so are all its users.
+        """
+        sid = message.params[0]
+        factory = self.ircfactory
+
+        if sid not in self.servers:
+            return
+        self.servers.pop(sid, None)
+        logger.warn("Server {sid} left the network", sid=sid)
+
+        for client in [client for client in factory.uids.values() if client.link is self and client.uid[:3] == sid]:
+            factory.quit(client, Link.SPLIT)
+
+        factory.propagate(line, exclude=self)
+
+    def handle_uid(self, message, line):
+        """
+        :<sid> UID <uid> <nick> <ts> <user> <host> :<name>, a user we haven't heard of.
+        """
+        uid, nick, ts, user, host, name = message.params[:6]
+        if uid in self.ircfactory.uids:
+            return
+
+        client = Client(sendfunc=_discard, writefunc=_discard, name=name)
+        client.host = host
+        client.user = user
+        client.uid = uid
+        client.ts = int(ts)
+        client.link = self
+        client.registered = True
+        client.nick = self.ircfactory.resolvenick(client, nick, client.ts)
+
+        self.ircfactory.introduce(client)
+
+    def handle_nick(self, message, line):
+        """
+        :<uid> NICK <nick> <ts>
+        """
+        client = self.remote(message.prefix)
+        if client is None:
+            return
+
+        ts = int(message.params[1])
+        nick = self.ircfactory.resolvenick(client, message.params[0], ts)
+        self.ircfactory.rename(client, nick, ts)
+
+    def handle_join(self, message, line):
+        """
+        :<uid> JOIN <channel>
+        """
+        client = self.remote(message.prefix)
+        if client is not None:
+            self.ircfactory.join(client, message.params[0])
+
+    def handle_part(self, message, line):
+        """
+        :<uid> PART <channel> :<reason>
+        """
+        client = self.remote(message.prefix)
+        channel = self.ircfactory.channels.get(message.params[0])
+        if client is not None and channel is not None and client in channel.clients:
+            self.ircfactory.part(client, channel, message.params[1])
+
+    def handle_quit(self, message, line):
+        """
+        :<uid> QUIT :<reason>
+        """
+        client = self.remote(message.prefix)
+        if client is not None:
+            self.ircfactory.quit(client, message.params[0])
+
+    def handle_privmsg(self, message, line):
+        """
+        :<uid> PRIVMSG <channel or uid> :<message>
+        """
+        self.deliver(Protocol.privmsg, message, line)
+
+    def handle_notice(self, message, line):
+        """
+        :<uid> NOTICE <channel or uid> :<message>
+        """
+        self.deliver(Protocol.notice, message, line)
+
+    def deliver(self, template, message, line):
+        """
+        A message for a channel goes to our users in it, and on to our other links.
+        A message for a user goes to them if they're ours, or down the link they're behind.
+
+        :type template: function
+        :type message: Message
+        :type line: str
+        :rtype: None
+        """
+        client = self.remote(message.prefix)
+        if client is None:
+            return
+
+        factory = self.ircfactory
+        target, text = message.params[0], message.params[1]
+
+        channel = factory.channels.get(target)
+        if channel is not None:
+            channel.relay(client, Protocol.encode(template(client, channel.name, text)))
+            factory.propagate(line, exclude=self)
+            return
+
+        recipient = factory.uids.get(target)
+        if recipient is None:
+            return
+        if recipient.link is None:
+            recipient.write(Protocol.encode(template(client, recipient.nick, text)))
+        elif recipient.link is not self:
+            recipient.link.write(Protocol.encode(line))
+
+    HANDLERS = {'PASS': handle_pass,
+                'PING': handle_ping,
+                'PONG': handle_pong,
+                'ERROR': handle_error,
+                'SERVER': handle_server,
+                'SQUIT': handle_squit,
+                'UID': handle_uid,
+                'NICK': handle_nick,
+                'JOIN': handle_join,
+                'PART': handle_part,
+                'QUIT': handle_quit,
+                'PRIVMSG': handle_privmsg,
+                'NOTICE': handle_notice}
+
+
+class LinkFactory(protocol.ReconnectingClientFactory):
+    """
+    Connects an IRCFactory to another server, or the bus, and keeps trying if the connection is lost.
+    """
+
+    maxDelay = 30
+
+    def __init__(self, ircfactory, password=None, keepalive=0):
+        """
+        :type ircfactory: IRCFactory
+        :type password: str
+        :type keepalive: float
+        """
+        self.ircfactory = ircfactory
+        self.password = password
+        self.keepalive = keepalive
+
+    def buildProtocol(self, addr):
+        self.resetDelay()
+        link = Link(self.ircfactory, self.password, self.keepalive, initiator=True)
+        link.factory = self
+        return link
+
+
+class LinkServerFactory(protocol.ServerFactory):
+    """
+    Accepts links from other servers for an IRCFactory.
+    """
+
+    def __init__(self, ircfactory, password=None, keepalive=0):
+        """
+        :type ircfactory: IRCFactory
+        :type password: str
+        :type keepalive: float
+        """
+        self.ircfactory = ircfactory
+        self.password = password
+        self.keepalive = keepalive
+
+    def buildProtocol(self, addr):
+        link = Link(self.ircfactory, self.password, self.keepalive)
+        link.factory = self
+        return link
@@ -1,61 +1,155 @@
 from builtins import staticmethod
+from time import perf_counter
 
-import re
-
+from domain.protocol import Protocol
+from system.metrics import Metrics
 from util import logger
 
 
+class HookProfile:
+    """
+    How much time one hook function has taken, and the line it took the longest on.
+    """
+
+    __slots__ = ('calls', 'total', 'worst', 'worstline')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.worst = 0.0
+        self.worstline = None
+
+
 class MessageHandler:
     """
     This class manages our hooks and it's its responsibility to pick and run the right hook function for each message.
+
+    Hooks are filed under the command they handle, so picking one is a dict lookup
+    no matter how many hooks there are. Every handled command is counted and timed in Metrics.
+
+    Hooks run on the reactor, so a slow one holds everyone up. With profiling on (see setprofiling),
+    every hook call is timed on its own, and calls that take longer than SLOW seconds are logged with the line
+    that caused them. It can be switched on and off while the server is running.
     """
 
-    HOOKS = []
+    HOOKS = {}  # command -> (function, minparams, registered)
+
+    PROFILING = False
+    SLOW = 0.05
+    PROFILE = {}  # hook function name -> HookProfile
 
     def __init__(self):
         pass
 
     @staticmethod
-    def addhook(regex, func):
+    def addhook(command, func, minparams=0, registered=True):
         """
-        Associates a function with a regex.
+        Associates a function with a command. If the command already has a hook, it's replaced.
+        Messages with fewer than minparams parameters never reach the function,
+        the client gets ERR_NEEDMOREPARAMS instead.
+        Unless registered is False, clients that haven't sent NICK and USER yet get ERR_NOTREGISTERED.
 
-        :type regex: str
+        :example: addhook('PART', handle_part, minparams=1)
+        :type command: str
         :type func: function
+        :type minparams: int
+        :type registered: bool
         :rtype: None
         """
-        logger.debug("Adding hook for '{regex}'", regex=regex)
-        MessageHandler.HOOKS.append((re.compile(regex), func))
+        logger.debug("Adding hook for '{command}'", command=command)
+        MessageHandler.HOOKS[command.upper()] = (func, minparams, registered)
 
     @staticmethod
-    def getfunc(data):
+    def setprofiling(enabled, slow=None):
         """
-        Tries hooks until it finds one that matches. The function and matching data is then returned.
+        Switches hook profiling on or off. slow is how many seconds a hook may take before it's logged as slow.
+        Profiles collected so far are kept, call resetprofile() to start over.
 
-        :type data: str
-        :rtype: (regex, function)
+        :type enabled: bool
+        :type slow: float
+        :rtype: None
         """
-        for regex, func in MessageHandler.HOOKS:
-            match = regex.match(data)
-            if match:
-                return func, match
+        MessageHandler.PROFILING = enabled
+        if slow is not None:
+            MessageHandler.SLOW = slow
+        logger.info("Hook profiling is {state}, slow is {slow} seconds",
+                    state='on' if enabled else 'off', slow=MessageHandler.SLOW)
 
-        logger.debug('Failed to handle line: "{data}"', data=data)
+    @staticmethod
+    def resetprofile():
+        """
+        Forgets all hook profiles.
 
-        return None, None
+        :rtype: None
+        """
+        MessageHandler.PROFILE.clear()
 
     @staticmethod
-    def handleline(data, client, channels):
+    def profile(func, message, seconds):
         """
-        Given supplied data, this method selects a function to run based on which regex gets a match first.
+        Adds a hook call to the hook's profile, and complains if it was slow.
+
+        :type func: function
+        :type message: Message
+        :type seconds: float
+        :rtype: None
+        """
+        name = func.__qualname__
+        profile = MessageHandler.PROFILE.get(name)
+        if profile is None:
+            profile = MessageHandler.PROFILE[name] = HookProfile()
+
+        profile.calls += 1
+        profile.total += seconds
+        if seconds > profile.worst:
+            profile.worst = seconds
+            profile.worstline = str(message)
+
+        if seconds > MessageHandler.SLOW:
+            logger.warn('Slow hook: {name} took {ms:.1f} ms on "{line}"', name=name, ms=seconds * 1000,
+                        line=str(message))
+
+    @staticmethod
+    def getfunc(command):
+        """
+        Looks up the hook for a command. The function, its minimum number of parameters
+        and whether it's only for registered clients are returned.
+
+        :type command: str
+        :rtype: (function, int, bool)
+        """
+        return MessageHandler.HOOKS.get(command, (None, 0, False))
+
+    @staticmethod
+    def handleline(message, client, factory):
+        """
+        Given a parsed message, this method selects a function to run based on its command.
         Returns a list of IRC friendly strings to send back to the server.
 
-        :type data: str
+        :type message: Message
         :type client: Client
-        :type channels: [Channel, ...]
+        :type factory: IRCFactory
         :rtype: [str, ...]
         """
-        # logger.debug("Handling line from {nick}: {data}", nick=client.nick, data=data)
-        func, match = MessageHandler.getfunc(data)
-        if func is not None:
-            return func(data, match.groupdict(), client, channels)
\ No newline at end of file
+        started = perf_counter()
+
+        func, minparams, registered = MessageHandler.getfunc(message.command)
+        if func is None:
+            if logger.isenabledfor(logger.DEBUG):
+                logger.debug('Failed to handle line: "{message}"', message=message)
+            Metrics.command('unknown', perf_counter() - started)
+            return
+
+        if registered and not client.registered:
+            response = [Protocol.notregistered(client, message.command)]
+        elif len(message.params) < minparams:
+            response = [Protocol.needmoreparams(client, message.command)]
+        elif MessageHandler.PROFILING:
+            hookstarted = perf_counter()
+            response = func(message, client, factory)
+            MessageHandler.profile(func, message, perf_counter() - hookstarted)
+        else:
+            response = func(message, client, factory)
+
+        Metrics.command(message.command, perf_counter() - started)
+        return response
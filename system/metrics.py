@@ -0,0 +1,180 @@
+"""
+Numbers about the running server. MessageHandler counts and times every command it handles,
+connections count the bytes and lines going in and out, and render() puts it all together,
+along with what IRCFactory knows about clients and channels, as plain text in the Prometheus format.
+
+Clients can see some of it with the STATS command, and main.py can serve all of it over HTTP.
+"""
+
+from builtins import staticmethod
+from bisect import bisect_left
+import heapq
+import time
+
+
+class Histogram:
+    """
+    Counts observations in fixed buckets, and keeps their count, sum and the worst one.
+    """
+
+    __slots__ = ('bounds', 'buckets', 'count', 'total', 'worst')
+
+    def __init__(self, bounds):
+        """
+        :type bounds: (float, ...)
+        """
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)  # the last one is +Inf
+        self.count = 0
+        self.total = 0.0
+        self.worst = 0.0
+
+    def observe(self, value):
+        """
+        :type value: float
+        :rtype: None
+        """
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.worst:
+            self.worst = value
+
+    def cumulative(self):
+        """
+        The buckets the way Prometheus wants them: every bound with how many observations were at or under it.
+
+        :rtype: [(str, int), ...]
+        """
+        result = []
+        running = 0
+        for bound, count in zip(self.bounds + (float('inf'),), self.buckets):
+            running += count
+            result.append(('+Inf' if bound == float('inf') else repr(bound), running))
+        return result
+
+
+class Metrics:
+    """
+    Holds the server's counters. Like MessageHandler, it's all static, there's only one server per process.
+    """
+
+    STARTED = time.time()
+
+    # Seconds. Most commands should end up in the first few.
+    BOUNDS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+    # How many of the biggest channels render() lists one by one
+    TOPCHANNELS = 20
+
+    COMMANDS = {}  # command -> Histogram of handling times
+    TOTALS = {'bytes_received': 0,
+              'bytes_sent': 0,
+              'lines_received': 0,
+              'lines_throttled': 0,
+              'flood_disconnects': 0,
+              'channels_reclaimed': 0,
+              'connections': 0}
+
+    def __init__(self):
+        pass
+
+    @staticmethod
+    def command(command, seconds):
+        """
+        Records that a command was handled, and how long that took.
+
+        :type command: str
+        :type seconds: float
+        :rtype: None
+        """
+        histogram = Metrics.COMMANDS.get(command)
+        if histogram is None:
+            histogram = Metrics.COMMANDS[command] = Histogram(Metrics.BOUNDS)
+        histogram.observe(seconds)
+
+    @staticmethod
+    def received(size):
+        """
+        :type size: int
+        :rtype: None
+        """
+        Metrics.TOTALS['bytes_received'] += size
+
+    @staticmethod
+    def sent(size):
+        """
+        :type size: int
+        :rtype: None
+        """
+        Metrics.TOTALS['bytes_sent'] += size
+
+    @staticmethod
+    def uptime():
+        """
+        :rtype: float
+        """
+        return time.time() - Metrics.STARTED
+
+    @staticmethod
+    def reset():
+        """
+        Forgets everything counted so far.
+
+        :rtype: None
+        """
+        Metrics.COMMANDS.clear()
+        for name in Metrics.TOTALS:
+            Metrics.TOTALS[name] = 0
+
+    @staticmethod
+    def render(factory):
+        """
+        Everything we know, in the Prometheus text format.
+
+        :type factory: IRCFactory
+        :rtype: str
+        """
+        lines = ['# TYPE kawaiirc_uptime_seconds gauge',
+                 'kawaiirc_uptime_seconds {value:.0f}'.format(value=Metrics.uptime())]
+
+        for name, value in sorted(Metrics.TOTALS.items()):
+            lines.append('# TYPE kawaiirc_{name}_total counter'.format(name=name))
+            lines.append('kawaiirc_{name}_total {value}'.format(name=name, value=value))
+
+        lines.append('# TYPE kawaiirc_command_seconds histogram')
+        for command, histogram in sorted(Metrics.COMMANDS.items()):
+            label = Metrics.label(command)
+            for bound, count in histogram.cumulative():
+                lines.append('kawaiirc_command_seconds_bucket{{command="{command}",le="{bound}"}} {count}'
+                             .format(command=label, bound=bound, count=count))
+            lines.append('kawaiirc_command_seconds_sum{{command="{command}"}} {total!r}'
+                         .format(command=label, total=histogram.total))
+            lines.append('kawaiirc_command_seconds_count{{command="{command}"}} {count}'
+                         .format(command=label, count=histogram.count))
+
+        channels = factory.channels
+        lines += ['# TYPE kawaiirc_clients gauge',
+                  'kawaiirc_clients {count}'.format(count=len(factory.clients)),
+                  '# TYPE kawaiirc_channels gauge',
+                  'kawaiirc_channels {count}'.format(count=len(channels)),
+                  '# TYPE kawaiirc_timers gauge',
+                  'kawaiirc_timers {count}'.format(count=len(factory.timers)),
+                  '# TYPE kawaiirc_channel_members gauge']
+
+        biggest = heapq.nlargest(Metrics.TOPCHANNELS, channels.values(), key=lambda channel: len(channel.clients))
+        for channel in biggest:
+            lines.append('kawaiirc_channel_members{{channel="{channel}"}} {count}'
+                         .format(channel=Metrics.label(channel.name), count=len(channel.clients)))
+
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def label(value):
+        """
+        Escapes a label value, since channel names can have just about anything in them.
+
+        :type value: str
+        :rtype: str
+        """
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
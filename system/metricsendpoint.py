@@ -0,0 +1,37 @@
+"""
+A tiny HTTP server that hands out Metrics.render(), for anything that wants to scrape us.
+It only ever listens on localhost, see main.py.
+"""
+
+from twisted.web import resource, server
+
+from system.metrics import Metrics
+
+
+class MetricsResource(resource.Resource):
+    """
+    Answers every GET, whatever the path, with the current metrics as plain text.
+    """
+
+    isLeaf = True
+
+    def __init__(self, factory):
+        """
+        :type factory: IRCFactory
+        """
+        super().__init__()
+        self._factory = factory
+
+    def render_GET(self, request):
+        request.setHeader(b'Content-Type', b'text/plain; version=0.0.4; charset=utf-8')
+        return Metrics.render(self._factory).encode()
+
+
+def site(factory):
+    """
+    Returns something reactor.listenTCP can serve the metrics with.
+
+    :type factory: IRCFactory
+    :rtype: twisted.web.server.Site
+    """
+    return server.Site(MetricsResource(factory))
@@ -0,0 +1,152 @@
+"""
+Every connection has a SendQueue. It's the buffer between us and the transport:
+lines pile up in it and are written in batches, and when the transport can't keep up
+(the client stopped reading), it tells us to pause and the lines stay here instead.
+
+That's what the sendq is. If it grows past its limit, the client is too slow to keep,
+and the connection is told about it through the overflow function.
+
+A long reply can be handed to a producer of its own (see system.lineproducer), which goes behind the sendq:
+it's paused and resumed along with it, so it never gets ahead of what the client is reading.
+"""
+
+from builtins import property
+
+from twisted.internet.interfaces import IPushProducer
+from zope.interface import implementer
+
+
+@implementer(IPushProducer)
+class SendQueue:
+    """
+    A per-connection output buffer that is also a streaming producer for its transport.
+    Register it with transport.registerProducer(sendqueue, True) so the transport can pause and resume it.
+    """
+
+    def __init__(self, transport, reactor, overflow, flushdelay=0.0, flushsize=16384, limit=1048576):
+        """
+        :type transport: twisted.internet.interfaces.ITransport
+        :type reactor: twisted.internet.interfaces.IReactorTime
+        :type overflow: function
+        :type flushdelay: float
+        :type flushsize: int
+        :type limit: int
+        """
+        self._transport = transport
+        self._reactor = reactor
+        self._overflow = overflow
+        self._flushdelay = flushdelay
+        self._flushsize = flushsize
+        self._limit = limit
+
+        self._buffer = []
+        self._size = 0
+        self._flushcall = None
+        self._paused = False
+        self._closed = False
+        self._producer = None
+
+    @property
+    def size(self):
+        """
+        How many bytes are waiting to be written.
+
+        :rtype: int
+        """
+        return self._size
+
+    @property
+    def paused(self):
+        """
+        True while the transport has asked us to stop writing.
+
+        :rtype: bool
+        """
+        return self._paused
+
+    def write(self, data):
+        """
+        Queues data. It'll be written at the end of this reactor tick, or right away if there's a lot of it.
+        Calls the overflow function instead if that would put the queue over its limit.
+
+        :type data: bytes
+        :rtype: None
+        """
+        if self._closed:
+            return
+
+        self._buffer.append(data)
+        self._size += len(data)
+
+        if self._size > self._limit:
+            self._overflow()
+        elif self._paused:
+            return
+        elif self._size >= self._flushsize:
+            self.flush()
+        elif self._flushcall is None:
+            self._flushcall = self._reactor.callLater(self._flushdelay, self.flush)
+
+    def flush(self):
+        """
+        Writes everything in the queue to the transport in one go, unless we're paused.
+
+        :rtype: None
+        """
+        if self._flushcall is not None:
+            if self._flushcall.active():
+                self._flushcall.cancel()
+            self._flushcall = None
+
+        if self._buffer and not self._paused and not self._closed:
+            self._transport.writeSequence(self._buffer)
+            self._buffer = []
+            self._size = 0
+
+    def attach(self, producer):
+        """
+        Lets producer write the rest of a long reply, whenever the transport is ready for it.
+        Whatever producer was attached before is stopped, so a client gets one long reply at a time.
+
+        :type producer: IPushProducer
+        :rtype: None
+        """
+        if self._producer is not None:
+            self._producer.stopProducing()
+        self._producer = producer
+
+        if self._closed:
+            producer.stopProducing()
+        elif not self._paused:
+            producer.resumeProducing()
+
+    def close(self):
+        """
+        Throws away whatever's queued, and everything written after this. Stops the producer too, if there is one.
+
+        :rtype: None
+        """
+        self._closed = True
+        if self._producer is not None:
+            self._producer.stopProducing()
+            self._producer = None
+        if self._flushcall is not None:
+            if self._flushcall.active():
+                self._flushcall.cancel()
+            self._flushcall = None
+        self._buffer = []
+        self._size = 0
+
+    def pauseProducing(self):
+        self._paused = True
+        if self._producer is not None:
+            self._producer.pauseProducing()
+
+    def resumeProducing(self):
+        self._paused = False
+        self.flush()
+        if self._producer is not None and not self._paused:
+            self._producer.resumeProducing()
+
+    def stopProducing(self):
+        self.close()
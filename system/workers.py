@@ -0,0 +1,176 @@
+"""
+Running the server as several processes, so it can use more than one core.
+
+The first process (the supervisor) doesn't talk to clients. It listens on the bus (see system.bus) and starts
+a number of workers, each a whole server with its own IRCFactory, linked to the others through the bus.
+If a worker dies, it's started again.
+
+All workers accept clients on the same port. Where the kernel has SO_REUSEPORT, every worker opens its own
+listening socket and the kernel spreads new connections between them. Everywhere else, the supervisor
+opens the socket and the workers inherit it.
+"""
+
+from builtins import super
+import os
+import socket
+import sys
+
+from twisted.internet import error, protocol, task
+
+from util import logger
+
+REUSEPORT = hasattr(socket, 'SO_REUSEPORT')
+
+RESPAWN_DELAY = 1.0  # seconds before a dead worker is started again
+MAX_WORKERS = 99  # worker sids are K01 to K99, a sid is three letters or digits
+
+
+def workersid(number):
+    """
+    The sid of worker number (counting from 1, up to MAX_WORKERS) on the bus.
+
+    :type number: int
+    :rtype: str
+    """
+    return 'K{number:02d}'.format(number=number)
+
+
+def bindsocket(port, reuseport=REUSEPORT):
+    """
+    Opens a listening TCP socket on every interface.
+
+    :type port: int
+    :type reuseport: bool
+    :rtype: socket.socket
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuseport:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(('', port))
+    sock.listen(128)
+    sock.setblocking(False)
+    return sock
+
+
+def listen(reactor, port, factory, fd=None):
+    """
+    Accepts clients for factory on port, sharing it with the other workers.
+    fd is the listening socket inherited from the supervisor, if there's no SO_REUSEPORT.
+
+    :type reactor: twisted.internet.interfaces.IReactorSocket
+    :type port: int
+    :type factory: IRCFactory
+    :type fd: int
+    :rtype: twisted.internet.interfaces.IListeningPort
+    """
+    if fd is not None:
+        return reactor.adoptStreamPort(fd, socket.AF_INET, factory)
+
+    sock = bindsocket(port)
+    listening = reactor.adoptStreamPort(sock.fileno(), socket.AF_INET, factory)
+    sock.close()  # adoptStreamPort has its own copy
+    return listening
+
+
+def watchparent(reactor, interval=1.0):
+    """
+    Stops the reactor if the supervisor goes away, so workers don't outlive it.
+
+    :type reactor: twisted.internet.interfaces.IReactorCore
+    :type interval: float
+    :rtype: task.LoopingCall
+    """
+    parent = os.getppid()
+
+    def check():
+        if os.getppid() != parent:
+            logger.warn("Supervisor is gone, stopping")
+            call.stop()
+            if reactor.running:
+                reactor.stop()
+
+    call = task.LoopingCall(check)
+    call.clock = reactor
+    call.start(interval, now=False)
+    return call
+
+
+class WorkerProcess(protocol.ProcessProtocol):
+    def __init__(self, supervisor, number):
+        """
+        :type supervisor: Supervisor
+        :type number: int
+        """
+        super().__init__()
+        self.supervisor = supervisor
+        self.number = number
+
+    def processEnded(self, reason):
+        self.supervisor.ended(self, reason)
+
+
+class Supervisor:
+    """
+    Starts count workers, and starts them again when they die, until stop() is called.
+    argv(number) gives the command line for worker number.
+    fd is a listening socket every worker should inherit, if they can't open their own.
+    """
+
+    def __init__(self, reactor, count, argv, fd=None):
+        """
+        :type reactor: twisted.internet.interfaces.IReactorProcess
+        :type count: int
+        :type argv: function
+        :type fd: int
+        """
+        self.reactor = reactor
+        self.count = count
+        self.argv = argv
+        self.fd = fd
+        self.processes = {}  # number -> WorkerProcess
+        self.stopping = False
+
+    def start(self):
+        for number in range(1, self.count + 1):
+            self.spawn(number)
+
+    def spawn(self, number):
+        """
+        :type number: int
+        """
+        if self.stopping:
+            return
+
+        childfds = {0: 0, 1: 1, 2: 2}
+        if self.fd is not None:
+            childfds[self.fd] = self.fd
+
+        worker = WorkerProcess(self, number)
+        self.processes[number] = worker
+        self.reactor.spawnProcess(worker, sys.executable, self.argv(number), env=os.environ, childFDs=childfds)
+        logger.info("Started worker {number}", number=number)
+
+    def ended(self, worker, reason):
+        """
+        :type worker: WorkerProcess
+        :type reason: twisted.python.failure.Failure
+        """
+        if self.processes.get(worker.number) is worker:
+            del self.processes[worker.number]
+
+        if not self.stopping:
+            logger.warn("Worker {number} died ({reason}), restarting it", number=worker.number,
+                        reason=reason.getErrorMessage())
+            self.reactor.callLater(RESPAWN_DELAY, self.spawn, worker.number)
+
+    def stop(self):
+        """
+        Stops every worker, and doesn't start them again.
+        """
+        self.stopping = True
+        for worker in list(self.processes.values()):
+            try:
+                worker.transport.signalProcess('TERM')
+            except error.ProcessExitedAlready:
+                pass
@@ -0,0 +1,22 @@
+"""
+IRC nicks and channel names are case insensitive, but not quite the way Python thinks.
+RFC 1459 says {}|^ are the lower case versions of []\\~, because Scandinavia.
+https://tools.ietf.org/html/rfc2812#section-2.2
+"""
+
+from builtins import str
+
+RFC1459 = str.maketrans('ABCDEFGHIJKLMNOPQRSTUVWXYZ[]\\~',
+                        'abcdefghijklmnopqrstuvwxyz{}|^')
+
+
+def irclower(name):
+    """
+    Lower cases a nick or channel name using RFC 1459 casemapping.
+    Use it on anything that's going to be a key in a dict of nicks or channels.
+
+    :example: irclower('Qt[Friend]') -> 'qt{friend}'
+    :type name: str
+    :rtype: str
+    """
+    return name.translate(RFC1459)
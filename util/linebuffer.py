@@ -0,0 +1,151 @@
+"""
+Splits what a client sends into lines, copying as little as we can on the way.
+
+Usually a read ends on a newline and nothing was left over from the one before, so the lines are decoded
+straight out of what was read, in one go, and split as a str. Only when a line comes in pieces does
+anything go into the connection's bytearray, and then everything that's complete by now is decoded
+straight out of a memoryview of it, and cut off the front of it (which CPython does without moving
+the rest of it around). Either way there's no bytes object per line.
+
+Lines can end in CRLF or just LF, and any other CR is thrown away (there can't be one in an IRC message).
+Like RFC 1459 says, a line can be at most 512 bytes with its CRLF. IRCv3 message tags get their own allowance
+on top of that (8191 bytes, with the @ and the space after them). Longer lines aren't handed on at all,
+feed() gives you TOOLONG in their place, once per line. Line lengths are only measured when there's more than
+maxline bytes of lines to go through, which for a client that sends one line at a time is never.
+Since a line that's too long is thrown away as soon as we know, a client can't make the buffer grow
+past the limit by never sending a newline.
+"""
+
+from builtins import memoryview, str, type
+
+
+class LineBuffer:
+    """
+    One connection's worth of not-yet-complete line.
+    """
+
+    TOOLONG = object()  # what feed() gives you instead of a line that was too long
+
+    __slots__ = ('_buffer', '_maxline', '_maxtags', '_skipping')
+
+    def __init__(self, maxline=512, maxtags=8191):
+        """
+        :type maxline: int
+        :type maxtags: int
+        """
+        self._buffer = bytearray()
+        self._maxline = maxline
+        self._maxtags = maxtags
+        self._skipping = False  # True while we're throwing away the rest of a line that's too long
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def feed(self, data):
+        """
+        Adds data to the buffer, and returns every complete line in it, decoded as UTF-8,
+        without the line ending. Empty lines are skipped. Bytes that aren't UTF-8 are replaced.
+
+        :type data: bytes
+        :rtype: [str | object, ...]
+        """
+        buffer = self._buffer
+        if buffer:
+            buffer += data
+            end = buffer.rfind(b'\n')
+            if end == -1:
+                return self.overflow([])
+
+            with memoryview(buffer) as view:
+                text, valid = LineBuffer.decode(view[:end + 1])
+            del buffer[:end + 1]
+        else:
+            end = data.rfind(b'\n')
+            if end == -1:
+                buffer += data
+                return self.overflow([])
+
+            if end + 1 == len(data):
+                try:
+                    text, valid = data.decode('utf-8'), True
+                except UnicodeDecodeError:
+                    text, valid = data.decode('utf-8', 'surrogateescape'), False
+            else:
+                buffer += data[end + 1:]
+                with memoryview(data) as view:
+                    text, valid = LineBuffer.decode(view[:end + 1])
+
+        lines = text.replace('\r', '').split('\n')
+        lines.pop()  # what came after the last newline, which is nothing
+        if self._skipping:
+            self._skipping = False
+            lines[0] = ''  # the end of a line that was too long
+
+        if end <= self._maxline - 2 and valid:
+            # No line in there can be too long
+            if '' in lines:
+                lines = [line for line in lines if line]
+            return self.overflow(lines) if buffer else lines
+
+        result = []
+        for line in lines:
+            if not line:
+                continue
+
+            if line.isascii():
+                result.append(line if not self.toolong(line) else LineBuffer.TOOLONG)
+            elif valid:
+                result.append(line if not self.toolong(line.encode('utf-8')) else LineBuffer.TOOLONG)
+            else:
+                raw = line.encode('utf-8', 'surrogateescape')
+                result.append(raw.decode('utf-8', 'replace') if not self.toolong(raw) else LineBuffer.TOOLONG)
+
+        return self.overflow(result)
+
+    @staticmethod
+    def decode(data):
+        """
+        Decodes data as UTF-8, and tells you if it really was UTF-8. If it wasn't, the bytes that aren't
+        are kept as surrogates (so lines can still be measured in bytes), and have to be replaced later.
+
+        :type data: bytes | memoryview
+        :rtype: (str, bool)
+        """
+        try:
+            return str(data, 'utf-8'), True
+        except UnicodeDecodeError:
+            return str(data, 'utf-8', 'surrogateescape'), False
+
+    def overflow(self, result):
+        """
+        If what's left in the buffer (the start of a line) is already too long, throws it away,
+        and everything after it up to the next newline. Adds TOOLONG to result for it, once.
+
+        :type result: list
+        :rtype: list
+        """
+        if len(self._buffer) > self._maxline + self._maxtags:
+            del self._buffer[:]
+            if not self._skipping:
+                self._skipping = True
+                result.append(LineBuffer.TOOLONG)
+        return result
+
+    def toolong(self, line):
+        """
+        Tells you if line (without its line ending) is over the limit.
+        It's a str if it's all ASCII, and encoded otherwise, so its length is in bytes either way.
+
+        :type line: str | bytes
+        :rtype: bool
+        """
+        body = 0
+        if line[:1] in ('@', b'@'):  # there are tags
+            space = line.find(' ' if type(line) is str else b' ')
+            if space == -1:
+                return len(line) > self._maxtags
+            if space + 1 > self._maxtags:
+                return True
+            body = space + 1
+
+        return len(line) - body > self._maxline - 2
@@ -1,27 +1,302 @@
 """
-This is a very simple logger. It might evolve over time and add file support and stuff.
+This is a very simple logger. It has levels, and it never makes the caller wait on a slow stdout or disk.
+
+Calling info(), warn() or debug() only checks the level and puts the unformatted record on a queue.
+A background thread takes records off the queue in batches, formats them and writes them out,
+either to stdout or to a file that's rotated when it gets too big, as plain text or as JSON lines.
+Since formatting happens later, on that thread, only pass arguments that won't change after the call.
+
+Logging below the level is cheap, but the arguments are still evaluated, and that's not free on a hot path.
+Either check isenabledfor(DEBUG) first, or wrap expensive arguments in Lazy so they're only worked out
+(on the writer thread) if the record is actually written.
+
+If the queue fills up because the writer can't keep up, records are dropped (and counted) rather than
+blocking the reactor. A record that can't be formatted (a bad format spec, a Lazy that raises) is written
+as best we can instead, and never stops the writer.
 """
 
+import atexit
 import datetime
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+DEBUG = 10
+INFO = 20
+WARN = 30
 
-debugmode = False
+LABELS = {DEBUG: 'DEBUG', INFO: 'INFO ', WARN: 'WARN '}
+
+level = INFO
 
 separator = '::'
 
+jsonlines = False
+
+QUEUE_SIZE = 100000
+BATCH_SIZE = 512
+
+_queue = queue.Queue(maxsize=QUEUE_SIZE)
+_sink = None
+_writer = None
+_dropped = 0  # records that didn't fit in the queue, counted by log() and reported by the writer
+_droplock = threading.Lock()
+
+
+class StreamSink:
+    """
+    Writes log lines to a stream, stdout unless told otherwise.
+    """
+
+    def __init__(self, stream=None):
+        """
+        :type stream: io.TextIOBase
+        """
+        self._stream = stream
+
+    def write(self, text):
+        """
+        :type text: str
+        """
+        stream = self._stream or sys.stdout
+        stream.write(text)
+        stream.flush()
+
+    def close(self):
+        pass
+
+
+class RotatingFileSink:
+    """
+    Writes log lines to a file. When the file would grow past maxbytes, it's renamed to path.1
+    (path.1 to path.2 and so on, keeping backups of them) and a new one is started.
+    """
+
+    def __init__(self, path, maxbytes=10485760, backups=5):
+        """
+        :type path: str
+        :type maxbytes: int
+        :type backups: int
+        """
+        self._path = path
+        self._maxbytes = maxbytes
+        self._backups = backups
+        self._file = open(path, 'a', encoding='utf-8')
+        self._size = self._file.tell()
+
+    def write(self, text):
+        """
+        :type text: str
+        """
+        data = text.encode('utf-8')
+        if self._maxbytes and self._size and self._size + len(data) > self._maxbytes:
+            self.rotate()
+
+        self._file.write(text)
+        self._file.flush()
+        self._size += len(data)
+
+    def rotate(self):
+        self._file.close()
+
+        for number in range(self._backups - 1, 0, -1):
+            older = '{path}.{number}'.format(path=self._path, number=number)
+            if os.path.exists(older):
+                os.replace(older, '{path}.{number}'.format(path=self._path, number=number + 1))
+        if self._backups:
+            os.replace(self._path, self._path + '.1')
+
+        self._file = open(self._path, 'w', encoding='utf-8')
+        self._size = 0
+
+    def close(self):
+        self._file.close()
+
+
+class Lazy:
+    """
+    An argument that isn't worked out until the record is formatted, which only happens if it's logged at all.
+    The function is called on the writer thread, so it should only look at things that won't change.
+
+    :example: logger.debug('Sending "{data}"', data=logger.Lazy(data.decode, 'utf-8', 'replace'))
+    """
+
+    __slots__ = ('_func', '_args')
+
+    def __init__(self, func, *args):
+        """
+        :type func: function
+        """
+        self._func = func
+        self._args = args
+
+    def __format__(self, spec):
+        return self._func(*self._args).__format__(spec)
+
+    def __str__(self):
+        return str(self._func(*self._args))
+
+
+def isenabledfor(loglevel):
+    """
+    Tells you if something logged at loglevel would be written, so you can skip building its arguments.
+
+    :example: if logger.isenabledfor(logger.DEBUG): ...
+    :type loglevel: int
+    :rtype: bool
+    """
+    return loglevel >= level
+
 
-def printf(label, basestring, *args, **kw):
-    print(label, separator, datetime.datetime.now(), separator, basestring.format(*args, **kw))
+def configure(loglevel=None, path=None, maxbytes=10485760, backups=5, asjson=False):
+    """
+    Sets the level and where log lines go. Without a path they go to stdout.
+
+    :example: configure(DEBUG, path='kawaiirc.log', asjson=True)
+    :type loglevel: int
+    :type path: str
+    :type maxbytes: int
+    :type backups: int
+    :type asjson: bool
+    :rtype: None
+    """
+    global level, jsonlines, _sink
+
+    if loglevel is not None:
+        level = loglevel
+    jsonlines = asjson
+
+    flush()
+    if _sink is not None:
+        _sink.close()
+    _sink = RotatingFileSink(path, maxbytes, backups) if path else StreamSink()
+
+
+def log(loglevel, basestring, *args, **kw):
+    """
+    Queues a record for the writer thread, if loglevel is high enough to be logged at all.
+
+    :type loglevel: int
+    :type basestring: str
+    :rtype: None
+    """
+    global _dropped
+
+    if loglevel < level:
+        return
+
+    if _writer is None:
+        _startwriter()
+
+    try:
+        _queue.put_nowait((loglevel, time.time(), basestring, args, kw))
+    except queue.Full:
+        with _droplock:
+            _dropped += 1
 
 
 def info(basestring, *args, **kw):
-    printf('INFO ', basestring, *args, **kw)
+    log(INFO, basestring, *args, **kw)
 
 
 def warn(basestring, *args, **kw):
-    printf('WARN ', basestring, *args, **kw)
+    log(WARN, basestring, *args, **kw)
 
 
 def debug(basestring, *args, **kw):
-    if debugmode:
-        printf('DEBUG', basestring, *args, **kw)
+    log(DEBUG, basestring, *args, **kw)
+
+
+def flush():
+    """
+    Waits until everything that's been logged so far has been written.
+
+    :rtype: None
+    """
+    if _writer is not None and _writer.is_alive():
+        _queue.join()
+
+
+def formatrecord(record):
+    """
+    Turns a record into a line of text, or of JSON if jsonlines is set.
+
+    :type record: (int, float, str, tuple, dict)
+    :rtype: str
+    """
+    loglevel, timestamp, basestring, args, kw = record
+
+    try:
+        message = basestring.format(*args, **kw)
+    except Exception as e:
+        message = '{basestring!r} {args!r} {kw!r} ({error!r})'.format(basestring=basestring, args=args, kw=kw,
+                                                                    error=e)
+
+    when = datetime.datetime.fromtimestamp(timestamp)
+
+    if jsonlines:
+        return json.dumps({'time': when.isoformat(),
+                           'level': LABELS.get(loglevel, str(loglevel)).strip().lower(),
+                           'message': message,
+                           'fields': kw},
+                          default=str) + '\n'
+
+    return ' '.join((LABELS.get(loglevel, str(loglevel)), separator, str(when), separator, message)) + '\n'
+
+
+def _formatsafely(record):
+    """
+    formatrecord(), except that a record it can't deal with at all (say, an argument whose repr raises)
+    still gets a line of its own, instead of an exception on the writer thread.
+
+    :type record: (int, float, str, tuple, dict)
+    :rtype: str
+    """
+    try:
+        return formatrecord(record)
+    except Exception as e:
+        return formatrecord((WARN, record[1], 'Couldn\'t format a log record for {basestring!r} ({error})', (),
+                             {'basestring': record[2], 'error': type(e).__name__}))
+
+
+def _startwriter():
+    global _writer, _sink
+
+    if _sink is None:
+        _sink = StreamSink()
+
+    _writer = threading.Thread(target=_write, name='logger', daemon=True)
+    _writer.start()
+
+
+def _write():
+    global _dropped
+
+    while True:
+        batch = [_queue.get()]
+        while len(batch) < BATCH_SIZE:
+            try:
+                batch.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        try:
+            lines = [_formatsafely(record) for record in batch]
+            with _droplock:
+                dropped, _dropped = _dropped, 0
+            if dropped:
+                lines.append(formatrecord((WARN, time.time(), 'Dropped {dropped} log records', (),
+                                           {'dropped': dropped})))
+
+            _sink.write(''.join(lines))
+        except Exception:
+            pass  # there's nowhere to log that logging failed, but the records after these still get their turn
+        finally:
+            for _ in batch:
+                _queue.task_done()
+
 
+atexit.register(flush)
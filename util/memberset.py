@@ -0,0 +1,87 @@
+from builtins import dict, len, iter, KeyError
+
+
+class MemberSet:
+    """
+    An insertion ordered set where every member can carry a little piece of data, like a channel prefix (@ or +).
+    It's what channels use to keep track of their clients, and what clients use to keep track of their channels.
+    Adding, removing and checking for members doesn't care how many members there are.
+    """
+
+    __slots__ = ('_members',)
+
+    def __init__(self, members=()):
+        """
+        :type members: [object, ...]
+        """
+        self._members = dict.fromkeys(members, '')
+
+    def __contains__(self, member):
+        return member in self._members
+
+    def __iter__(self):
+        return iter(self._members)
+
+    def __len__(self):
+        return len(self._members)
+
+    def add(self, member, data=''):
+        """
+        Adds a member, unless it's already in here. Returns True if it was added.
+
+        :type member: object
+        :type data: str
+        :rtype: bool
+        """
+        if member in self._members:
+            return False
+        self._members[member] = data
+        return True
+
+    def remove(self, member):
+        """
+        Removes a member. Raises KeyError if it isn't in here.
+
+        :type member: object
+        :rtype: None
+        """
+        del self._members[member]
+
+    def discard(self, member):
+        """
+        Removes a member if it's in here. Returns True if it was.
+
+        :type member: object
+        :rtype: bool
+        """
+        return self._members.pop(member, None) is not None
+
+    def get(self, member, default=None):
+        """
+        Returns the data that goes with a member.
+
+        :example: channel.clients.get(client) -> '@'
+        :type member: object
+        :rtype: str
+        """
+        return self._members.get(member, default)
+
+    def set(self, member, data):
+        """
+        Changes the data that goes with a member that's already in here.
+
+        :type member: object
+        :type data: str
+        :rtype: None
+        """
+        if member not in self._members:
+            raise KeyError(member)
+        self._members[member] = data
+
+    def items(self):
+        """
+        Members and their data, in the order they were added.
+
+        :rtype: [(object, str), ...]
+        """
+        return self._members.items()
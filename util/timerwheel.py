@@ -0,0 +1,94 @@
+"""
+A hashed timer wheel, for when there's one timer per client and a lot of clients.
+
+Time goes by in ticks. The wheel has a slot for every tick, and a timer goes in the slot of the tick it's due on
+(wrapped around, so timers further away than the wheel is long wait for their round). Every tick, one looping
+call looks at one slot. Setting, moving and cancelling a timer is a couple of dict operations, and the reactor
+only ever has the one call to keep track of, no matter how many timers there are.
+
+Timers fire on the first tick at or after they're due, so they can be up to one tick late. That's fine for
+the things we use it for (pinging idle clients, dropping ones that never finish registering).
+"""
+
+from builtins import int, len, range
+import math
+
+from twisted.internet import task
+
+
+class TimerWheel:
+    """
+    Timers that are filed under a key, one per key. Setting a timer for a key that has one replaces it.
+    The wheel starts turning when the first timer is set.
+    """
+
+    def __init__(self, reactor, tick=1.0, size=512):
+        """
+        :type reactor: twisted.internet.interfaces.IReactorTime
+        :type tick: float
+        :type size: int
+        """
+        self._reactor = reactor
+        self._tick = tick
+        self._slots = [dict() for _ in range(size)]  # key -> (due tick, function), for the timers due on each tick
+        self._where = dict()  # key -> which slot its timer is in
+        self._now = 0  # ticks since the wheel started
+        self._loop = None
+
+    def __len__(self):
+        return len(self._where)
+
+    def schedule(self, key, delay, func):
+        """
+        Calls func() in delay seconds (give or take a tick), instead of whatever key's timer was going to call.
+
+        :type key: object
+        :type delay: float
+        :type func: function
+        :rtype: None
+        """
+        self.cancel(key)
+
+        due = self._now + max(1, int(math.ceil(delay / self._tick)))
+        index = due % len(self._slots)
+        self._slots[index][key] = (due, func)
+        self._where[key] = index
+
+        if self._loop is None:
+            self._loop = task.LoopingCall.withCount(self.advance)
+            self._loop.clock = self._reactor
+            self._loop.start(self._tick, now=False)
+
+    def cancel(self, key):
+        """
+        Forgets key's timer, if it has one.
+
+        :type key: object
+        :rtype: None
+        """
+        index = self._where.pop(key, None)
+        if index is not None:
+            del self._slots[index][key]
+
+    def advance(self, count=1):
+        """
+        Moves the wheel count ticks ahead, calling every timer that's due on the way.
+        The looping call does this every tick, with more than one if the reactor fell behind.
+
+        :type count: int
+        :rtype: None
+        """
+        slots = self._slots
+        for _ in range(count):
+            self._now += 1
+            slot = slots[self._now % len(slots)]
+            if not slot:
+                continue
+
+            due = [(key, timer) for key, timer in slot.items() if timer[0] <= self._now]
+            for key, timer in due:
+                if slot.get(key) is not timer:  # an earlier timer on this tick moved or cancelled it
+                    continue
+                del slot[key]
+                del self._where[key]
+                timer[1]()
@@ -0,0 +1,85 @@
+"""
+IRC masks, the kind LIST and WHO take: * matches any number of characters, ? matches exactly one,
+and everything else matches itself, compared with RFC 1459 casemapping.
+
+A mask is usually matched against a lot of names in a row (every channel, every user), and the same few
+masks come up over and over, so each one is compiled once and kept in an LRU cache.
+
+Names and masks both come from users, so matching can't be left to a regular expression with .* in it:
+*a*a*a*a*b against a long enough name backtracks for minutes. Instead, a mask is cut up at its stars.
+The pieces in between have a fixed length, so each can be looked for with a regular expression that
+can't backtrack, and it's always right to take the first place each one fits, left to right.
+The first piece has to be at the start of the name, and the last at the end. That's at worst
+the length of the name times the length of the mask, however many stars there are.
+"""
+
+from builtins import len, str
+import functools
+import re
+
+from util.casemapping import irclower
+
+
+def ismask(text):
+    """
+    Tells you if text has wildcards in it, or is just a name.
+
+    :type text: str
+    :rtype: bool
+    """
+    return '*' in text or '?' in text
+
+
+def _piece(text):
+    """
+    A regular expression for a piece of mask without stars in it.
+
+    :type text: str
+    :rtype: re.Pattern
+    """
+    return re.compile(''.join('.' if char == '?' else re.escape(char) for char in text), re.DOTALL)
+
+
+@functools.lru_cache(maxsize=256)
+def compilemask(mask):
+    """
+    Returns a function that tells you if an already irclower()ed name matches mask.
+
+    :example: compilemask('#Qt*')('#qtfriends') -> True
+    :type mask: str
+    :rtype: function
+    """
+    pieces = irclower(mask).split('*')
+    if len(pieces) == 1:
+        whole = _piece(pieces[0])
+        return lambda name: whole.fullmatch(name) is not None
+
+    first, last = pieces[0], pieces[-1]
+    head, tail = _piece(first), _piece(last)
+    middle = [_piece(piece) for piece in pieces[1:-1] if piece]
+
+    def match(name):
+        if head.match(name) is None:
+            return False
+        position = len(first)
+        for piece in middle:
+            found = piece.search(name, position)
+            if found is None:
+                return False
+            position = found.end()
+        start = len(name) - len(last)
+        return start >= position and tail.match(name, start) is not None
+
+    return match
+
+
+def matchmask(mask, name):
+    """
+    Tells you if name matches mask.
+
+    :example: matchmask('qt?riend', 'QtFriend') -> True
+    :type mask: str
+    :type name: str
+    :rtype: bool
+    """
+    return compilemask(mask)(irclower(name))